@@ -9,5 +9,89 @@ CO_ORIGINS = '*'
 EE_ACCOUNT = '<EE_ACCOUNT>'
 EE_KEY_PATH = '<EE_KEY_PATH>'
 
+# Per-user EE sessions when EE_TOKEN_ENABLED (sepal-user header)
+EE_TOKEN_ENABLED = False
+EE_USER_SESSION_POOL_SIZE = 64
+EE_USER_SESSION_TTL = 3000
+
+# getMapId results cache, keep the ttl (seconds) below the tile url lifetime
+MAP_ID_CACHE_SIZE = 2048
+MAP_ID_CACHE_TTL = 3600
+
+# Cache shared by the uwsgi processes for map ids and gateway results.
+# RESULT_CACHE_BACKEND: 'memory' (per process), 'uwsgi' (cache2 named by
+# RESULT_CACHE_LOCATION, see gee-uwsgi.ini), 'sqlite' (file path) or 'redis' (url)
+RESULT_CACHE_BACKEND = 'memory'
+RESULT_CACHE_LOCATION = None
+RESULT_CACHE_SIZE = 20000
+RESULT_CACHE_TTL = 3600
+
+# Identical concurrent time series / degradation requests share one computation.
+# Set a directory to also coalesce across the uwsgi processes; results are kept
+# there for SINGLE_FLIGHT_RESULT_TTL seconds.
+SINGLE_FLIGHT_LOCK_DIR = None
+SINGLE_FLIGHT_RESULT_TTL = 30
+
+# Persistent store of fetched time series, repeat requests only compute the
+# dates not stored yet. The last LOOKBACK_DAYS are always fetched again to pick
+# up late scenes. None disables the store.
+TIME_SERIES_STORE_PATH = 'cache/timeseries.sqlite'
+TIME_SERIES_STORE_LOOKBACK_DAYS = 30
+
+# Plots per reduceRegions pass of /timeSeriesIndexBatch
+BATCH_CHUNK_SIZE = 100
+
+# Long time series are split by source collection and windows of FAN_OUT_YEARS
+# years, computed by at most FAN_OUT_WORKERS concurrent EE calls per process
+FAN_OUT_WORKERS = 8
+FAN_OUT_YEARS = 5
+
+# Region reductions coarsen their scale until the polygon is estimated to fit
+# in ADAPTIVE_SCALE_MAX_PIXELS pixels, and retry at most ADAPTIVE_SCALE_RETRIES
+# times with a coarser scale when EE still rejects them for their size
+ADAPTIVE_SCALE_MAX_PIXELS = 1e7
+ADAPTIVE_SCALE_RETRIES = 2
+
+# How /ts/spectrals extracts the point values: 'reduceRegion', one reduction
+# per image, or 'getRegion', one call whose values are decoded locally
+SPECTRALS_ENGINE = 'reduceRegion'
+
+# Snap the points of /ts/spectrals, /ts/images and /timeSeriesForPoint to the
+# center of their 30 m Landsat pixel, so clicks in one pixel share cached results
+SNAP_POINTS = True
+
+# name -> yearly ImageCollection sampled by /timeSeriesAssetForPoint, all in
+# one EE round trip. None uses the tree canopy, loss and cropland defaults.
+TIME_SERIES_ASSETS = None
+
+# Statistics of every named basin and landscape of /getStats, precomputed in
+# this SQLite file and refreshed in the background every REFRESH seconds.
+# None computes them on each request.
+REGION_STATISTICS_PATH = 'cache/regionstats.sqlite'
+REGION_STATISTICS_REFRESH = 86400
+
+# Acquisition dates of /getAvailableCollectionDates, indexed per collection
+# and area of interest polygon in this SQLite file, so repeat
+# requests only ask EE for new dates. The last LOOKBACK_DAYS are always asked
+# again to pick up late scenes. None disables the index.
+COLLECTION_DATE_INDEX_PATH = 'cache/collectiondates.sqlite'
+COLLECTION_DATE_INDEX_LOOKBACK_DAYS = 30
+
+# /getAvailableCollectionDates starts computing the /getDegraditionTileUrl urls
+# of up to DATES of the dates it returns (the nearest to its nearDate, else the
+# latest, first), WORKERS at a time, with the stretch or visParams of the
+# request. 0 disables the prefetch.
+DEGRADATION_PREFETCH_DATES = 0
+DEGRADATION_PREFETCH_WORKERS = 2
+
+# PNGs of /ts/chip and /ts/image_chip, kept in this directory with their doy
+# and iid and served with an ETag, least recently used first out once they take
+# more than MAX_BYTES. None downloads every chip from EE.
+CHIP_CACHE_PATH = 'cache/chips'
+CHIP_CACHE_MAX_BYTES = 536870912
+
+# Initialize EE and pre-build common collections when a worker starts
+WARMUP = True
+
 import logging
 LOGGING_LEVEL = logging.INFO
@@ -0,0 +1,175 @@
+""" Microbenchmarks of the gateway's local post-processing.
+
+    python -m gee.benchmarks [name ...]
+
+runs the named benchmarks, all of them by default.
+"""
+import datetime
+import sys
+import timeit
+from itertools import groupby
+import numpy as np
+import gee.series
+
+
+def aggRegionLoop(regionList):
+    """ The pure Python aggRegion the NumPy version replaced, kept as reference """
+    values = []
+    for i in range(len(regionList)):
+        if i != 0:
+            date = datetime.datetime.fromtimestamp(regionList[i][-2]/1000.).strftime("%Y-%m-%d")
+            values.append([date,regionList[i][-1]])
+
+    sort = sorted(values, key=lambda x: x[0])
+
+    out = []
+    for key, group in groupby(sort, key=lambda x: x[0][:10]):
+        data = list(group)
+        agg = sum(j for i, j in data if j != None)
+        dates = key.split('-')
+        timestamp = datetime.datetime(int(dates[0]),int(dates[1]),int(dates[2]))
+        if agg != 0:
+            out.append([int(timestamp.strftime('%s'))*1000,agg/float(len(data))])
+
+    return out
+
+
+def syntheticRegion(years=40, scenesPerYear=45, pixels=200, seed=0):
+    """ getRegion output of a polygon of `pixels` pixels over `years` years of
+    Landsat, about 5% of the pixel values masked """
+    random = np.random.RandomState(seed)
+    scenes = years * scenesPerYear
+    start = 315532800000  # 1980-01-01
+    times = np.sort(random.randint(0, years * 365, scenes)) * gee.series.DAY_MS + start + 37800000
+    rows = [['id', 'longitude', 'latitude', 'time', 'index']]
+    for scene, time in enumerate(times.tolist()):
+        values = random.uniform(-1, 1, pixels)
+        masked = random.uniform(0, 1, pixels) < 0.05
+        for pixel in range(pixels):
+            rows.append(['scene%d' % scene, 0.0, 0.0, time, None if masked[pixel] else float(values[pixel])])
+    return rows
+
+
+def _report(name, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print('  %-28s %10.2f ms' % (name, seconds * 1000))
+    return seconds
+
+
+def benchmarkAggRegion():
+    regionList = syntheticRegion()
+    print('aggRegion, %d getRegion rows' % (len(regionList) - 1))
+    loop = _report('python loop', lambda: aggRegionLoop(regionList), 3)
+    seconds = {}
+    for reducer in gee.series.DAY_REDUCERS:
+        seconds[reducer] = _report('numpy ' + reducer, lambda: gee.series.aggregateRegion(regionList, reducer), 3)
+    print('  speedup (mean) %.1fx' % (loop / seconds['mean']))
+
+
+def syntheticSpectralsRegion(images=1500, seed=0):
+    """ getRegion output of getSpectralsForPointByRegion at one point """
+    random = np.random.RandomState(seed)
+    sensors = ['LT04', 'LT05', 'LE07', 'LC08']
+    rows = [['id', 'longitude', 'latitude', 'time', 'B1', 'B2', 'B3', 'B4', 'B5', 'B7', 'cfmask']]
+    times = np.sort(random.randint(0, 38 * 365, images)) * gee.series.DAY_MS + 441763200000
+    for image, time in enumerate(times.tolist()):
+        sensor = sensors[image % 4]
+        rows.append(['%d_%s_044034_%d' % (image % 4, sensor, image), 0.0, 0.0, time] +
+                     random.randint(0, 5000, 6).tolist() + [int(random.choice([66, 68, 72, 80, 96, 322]))])
+    return rows
+
+
+def _initializeEE():
+    """ EE session of config.py, None when there is none """
+    try:
+        import config
+        import gee.session
+        gee.session.initialize(config.EE_ACCOUNT, config.EE_KEY_PATH)
+        return True
+    except Exception as e:
+        print('  no EE session (%s), skipping the EE round trips' % e)
+        return None
+
+
+def benchmarkSpectrals(point=(-122.3, 37.8)):
+    import gee.utils
+    regionList = syntheticSpectralsRegion()
+    print('/ts/spectrals, %d images' % (len(regionList) - 1))
+    _report('getRegion local decoding', lambda: gee.utils.regionToSpectrals(regionList), 10)
+    if _initializeEE():
+        # __wrapped__ bypasses the result cache
+        _report('reduceRegion engine (EE)', lambda: gee.utils.getTsTimeSeriesForPoint.__wrapped__(point), 1)
+        _report('getRegion engine (EE)', lambda: gee.utils.getSpectralsForPointByRegion.__wrapped__(point), 1)
+
+
+class FakeEE(object):
+    """ Stand-in for the ee module and everything it builds: every attribute
+    and call gives another FakeEE, getInfo counts a round trip and answers 1. """
+
+    def __init__(self, counter=None):
+        self.counter = counter if counter is not None else {'getInfo': 0}
+
+    def __getattr__(self, name):
+        return FakeEE(self.counter)
+
+    def __call__(self, *args, **kwargs):
+        return FakeEE(self.counter)
+
+    def getInfo(self):
+        self.counter['getInfo'] += 1
+        return 1
+
+
+def getLandsatProbing(options, ee):
+    """ The collection building of getLandsat before the probes were removed,
+    kept as reference """
+    import gee.inputs
+    start, end, region = options['start'], options['end'], options.get('region')
+    col = None
+    for name, prepare in [('LANDSAT/LT04/C01/T1_SR', gee.inputs.prepareL4L5),
+                          ('LANDSAT/LT05/C01/T1_SR', gee.inputs.prepareL4L5),
+                          ('LANDSAT/LE07/C01/T1_SR', gee.inputs.prepareL7),
+                          ('LANDSAT/LC08/C01/T1_SR', gee.inputs.prepareL8)]:
+        fcollection = ee.ImageCollection(name).filterDate(start, end).filterBounds(region)
+        if fcollection.size().getInfo() > 0:
+            collection = fcollection.map(prepare, True).sort('system:time_start')
+            col = collection if col is None else col.merge(collection)
+    # f8size was probed twice
+    ee.ImageCollection('LANDSAT/LC08/C01/T1_SR').filterDate(start, end).filterBounds(region).size().getInfo()
+    return ee.ImageCollection(gee.inputs.doIndices(col).select(options['targetBands']))
+
+
+def benchmarkGetLandsat(roundTripSeconds=0.25):
+    """ EE round trips getLandsat makes before the caller's own getInfo, with
+    a fake ee, and the latency they add at roundTripSeconds each """
+    import gee.inputs
+    options = {'start': '2019-06-01', 'end': '2019-06-03', 'targetBands': ['RED', 'GREEN', 'BLUE'],
+               'sensors': {'l4': True, 'l5': True, 'l7': True, 'l8': True}}
+    print('getLandsat, round trips per call (%.0f ms each)' % (roundTripSeconds * 1000))
+    realEE = gee.inputs.ee
+    try:
+        for name, build in [('size probes', lambda fake: getLandsatProbing(options, fake)),
+                            ('lazy builder', lambda fake: gee.inputs.getLandsat(options))]:
+            fake = FakeEE()
+            gee.inputs.ee = fake
+            build(fake)
+            calls = fake.counter['getInfo']
+            print('  %-28s %10d    ~%d ms' % (name, calls, calls * roundTripSeconds * 1000))
+    finally:
+        gee.inputs.ee = realEE
+
+
+BENCHMARKS = {
+    'aggRegion': benchmarkAggRegion,
+    'spectrals': benchmarkSpectrals,
+    'getLandsat': benchmarkGetLandsat
+}
+
+
+def main(names):
+    for name in names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
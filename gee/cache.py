@@ -0,0 +1,303 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import gee.session
+from gee.gee_exception import GEEException
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+
+class TTLCache(object):
+    """ Thread-safe in-process LRU cache whose entries expire after ttl seconds.
+    Also the default, per-worker, backend of the shared caches below. """
+
+    def __init__(self, maxSize=1024, ttl=3600):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            expiresAt, value = entry
+            if now >= expiresAt:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.time() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['size'] = len(self._entries)
+        return stats
+
+
+def normalizeVisParams(visParams):
+    """ Canonical form of visParams so that equivalent requests share a key,
+    e.g. {'bands': 'B4, B5,B3', 'min': 0} and {'min': '0', 'bands': ['B4', 'B5', 'B3']}. """
+    normalized = {}
+    for name, value in (visParams or {}).items():
+        if isinstance(value, (list, tuple)):
+            value = ','.join(str(v) for v in value)
+        normalized[name] = ','.join(part.strip() for part in str(value).split(','))
+    return normalized
+
+
+def hashKey(*parts):
+    """ sha256 of the json serialization of parts. """
+    serialized = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+_sqliteConnections = threading.local()
+# connections opened before a fork (the uwsgi master imports the app), which
+# the child must neither use nor close
+_inheritedConnections = []
+
+
+def connectSqlite(path):
+    """ Connection to the SQLite file at path for the calling thread and
+    process. """
+    connections = getattr(_sqliteConnections, 'byPath', None)
+    if connections is None or _sqliteConnections.pid != os.getpid():
+        if connections:
+            _inheritedConnections.extend(connections.values())
+        connections = _sqliteConnections.byPath = {}
+        _sqliteConnections.pid = os.getpid()
+    connection = connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(path, timeout=10, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connections[path] = connection
+    return connection
+
+
+class UwsgiCacheBackend(object):
+    """ uwsgi cache2 shared by all the processes of the uwsgi instance, e.g.
+
+        cache2 = name=gateway,items=20000,blocks=32768,blocksize=16384,bitmap=1
+
+    in gee-uwsgi.ini. Items and blocks bound the size of the cache. uwsgi
+    refuses values that do not fit in its free blocks (in a single block
+    without bitmap=1): those are kept in a small per-process cache instead
+    and counted as oversized.
+    """
+
+    def __init__(self, cacheName='gateway'):
+        if uwsgi is None:
+            raise GEEException("uwsgi cache requested but not running under uwsgi")
+        self.cacheName = cacheName
+        self.oversized = TTLCache(maxSize=256)
+        self.stats = {'oversized': 0}
+
+    def get(self, key):
+        value = uwsgi.cache_get(key, self.cacheName)
+        if value is None:
+            return self.oversized.get(key)
+        return json.loads(value.decode('utf-8'))
+
+    def set(self, key, value, ttl):
+        if uwsgi.cache_update(key, json.dumps(value).encode('utf-8'), int(ttl), self.cacheName):
+            return
+        self.stats['oversized'] += 1
+        self.oversized.set(key, value, ttl)
+
+    def getStats(self):
+        return {'backend': 'uwsgi', 'oversized': self.stats['oversized'], 'local': self.oversized.getStats()}
+
+
+class SqliteCacheBackend(object):
+    """ Cache in a local SQLite file, shared by the processes on the node.
+    Every 100 writes it is trimmed back to maxSize entries, least recently
+    used first. """
+
+    def __init__(self, path, maxSize=20000):
+        self.path = path
+        self.maxSize = maxSize
+        self._writes = 0
+        self._connect().execute('CREATE TABLE IF NOT EXISTS entries ('
+                                'key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)')
+
+    def _connect(self):
+        return connectSqlite(self.path)
+
+    def get(self, key):
+        now = time.time()
+        connection = self._connect()
+        row = connection.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if now >= row[1]:
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            return None
+        connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                           (key, json.dumps(value), now + ttl, now))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim(connection, now)
+
+    def _trim(self, connection, now):
+        connection.execute('DELETE FROM entries WHERE expires <= ?', (now,))
+        count = connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if count > self.maxSize:
+            connection.execute('DELETE FROM entries WHERE key IN '
+                               '(SELECT key FROM entries ORDER BY accessed LIMIT ?)', (count - self.maxSize,))
+
+    def getStats(self):
+        count = self._connect().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'backend': 'sqlite', 'size': count}
+
+
+class RedisCacheBackend(object):
+    """ Cache in a Redis compatible server (redis, keydb, a local stand-in...).
+    The size limit is the server's maxmemory / eviction policy. """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='gee-gateway:'):
+        try:
+            import redis
+        except ImportError:
+            raise GEEException("redis cache requested but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return json.loads(value.decode('utf-8'))
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl))
+
+    def getStats(self):
+        return {'backend': 'redis'}
+
+
+class Cache(object):
+    """ Named view on a cache backend with its own ttl and hit/miss counters. """
+
+    def __init__(self, name, backend, ttl):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        try:
+            value = self.backend.get(self.name + ':' + key)
+        except Exception:
+            self._count('errors')
+            value = None
+        self._count('misses' if value is None else 'hits')
+        return value
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.backend.set(self.name + ':' + key, value, ttl or self.ttl)
+        except Exception:
+            self._count('errors')
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['backend'] = self.backend.getStats()
+        return stats
+
+
+def createBackend(name, location=None, maxSize=20000):
+    """ Backend from the RESULT_CACHE_BACKEND setting: memory, uwsgi, sqlite or redis. """
+    if name == 'uwsgi':
+        return UwsgiCacheBackend(location or 'gateway')
+    elif name == 'sqlite':
+        location = location or 'gee-gateway-cache.sqlite'
+        if os.path.dirname(location) and not os.path.isdir(os.path.dirname(location)):
+            os.makedirs(os.path.dirname(location))
+        return SqliteCacheBackend(location, maxSize)
+    elif name == 'redis':
+        return RedisCacheBackend(location or 'redis://localhost:6379/0')
+    return TTLCache(maxSize=maxSize)
+
+
+# url_format of ee getMapId results, keyed by serialized expression and visParams.
+# Tile urls stay valid for several hours, the default ttl keeps well below that.
+mapIdCache = Cache('mapid', TTLCache(maxSize=2048), 3600)
+
+# json results of the gateway computations, see cached
+resultCache = Cache('result', TTLCache(maxSize=1024), 3600)
+
+
+def configure(mapIdCacheSize=None, mapIdCacheTtl=None, backend=None, location=None, size=None, ttl=None):
+    if mapIdCacheSize:
+        mapIdCache.backend.maxSize = int(mapIdCacheSize)
+    if mapIdCacheTtl:
+        mapIdCache.ttl = int(mapIdCacheTtl)
+    if ttl:
+        resultCache.ttl = int(ttl)
+    if backend and backend != 'memory':
+        shared = createBackend(backend, location, int(size or 20000))
+        mapIdCache.backend = shared
+        resultCache.backend = shared
+    elif size:
+        resultCache.backend.maxSize = int(size)
+
+
+def cached(fn):
+    """ Decorator keeping the json result of fn in resultCache. The key is the
+    function name, its arguments and the bound user session. """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = hashKey(fn.__name__, args, kwargs, gee.session.currentSessionKey())
+        value = resultCache.get(key)
+        if value is None:
+            value = fn(*args, **kwargs)
+            if value is not None:
+                resultCache.set(key, value)
+        return value
+    return wrapper
+
+
+def getCacheStats():
+    return {
+        'mapId': mapIdCache.getStats(),
+        'result': resultCache.getStats()
+    }
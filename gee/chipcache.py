@@ -0,0 +1,177 @@
+import datetime
+import hashlib
+import os
+import threading
+import time
+import urllib.request
+import logging
+from logging.handlers import RotatingFileHandler
+import gee.cache
+import gee.pixel
+import gee.session
+
+logger = logging.getLogger(__name__)
+handler = RotatingFileHandler('gee-gateway-nginx.log', maxBytes=10485760, backupCount=10)
+logger.addHandler(handler)
+logger.setLevel(logging.DEBUG)
+
+
+class ChipCache(object):
+    """ Content-addressed disk cache of the TimeSync chip PNGs.
+
+    The bytes of a chip are stored once, in a file named by their sha256 that
+    is also their ETag. A SQLite index maps chip keys to the file and to the
+    iid and doy of the image. Once the files take more than maxBytes, the
+    least recently used keys are dropped with the files no key refers to
+    anymore. The directory is shared by the processes on the node.
+    """
+
+    def __init__(self, path, maxBytes=536870912):
+        self.path = path
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+        connection = self._connect()
+        connection.execute('CREATE TABLE IF NOT EXISTS chips ('
+                           'key TEXT PRIMARY KEY, digest TEXT, size INTEGER, iid TEXT, doy TEXT, '
+                           'accessed REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS chips_digest ON chips (digest)')
+
+    def _connect(self):
+        return gee.cache.connectSqlite(os.path.join(self.path, 'index.sqlite'))
+
+    def _count(self, name, count=1):
+        with self._lock:
+            self.stats[name] += count
+
+    def _file(self, digest):
+        return os.path.join(self.path, digest[:2], digest + '.png')
+
+    def get(self, key):
+        """ {data, etag, iid, doy} of key, None when it is not cached. """
+        connection = self._connect()
+        row = connection.execute('SELECT digest, iid, doy FROM chips WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            try:
+                with open(self._file(row[0]), 'rb') as f:
+                    data = f.read()
+                connection.execute('UPDATE chips SET accessed = ? WHERE key = ?', (time.time(), key))
+                self._count('hits')
+                return {'data': data, 'etag': row[0], 'iid': row[1], 'doy': row[2]}
+            except IOError:
+                # trimmed by another process
+                connection.execute('DELETE FROM chips WHERE key = ?', (key,))
+        self._count('misses')
+        return None
+
+    def put(self, keys, data, iid, doy):
+        """ Store data under every key of keys and return its etag. """
+        digest = hashlib.sha256(data).hexdigest()
+        filename = self._file(digest)
+        if not os.path.exists(filename):
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temporary = '%s.%d.%d' % (filename, os.getpid(), threading.get_ident())
+            with open(temporary, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, filename)
+        now = time.time()
+        connection = self._connect()
+        connection.executemany('INSERT OR REPLACE INTO chips (key, digest, size, iid, doy, accessed) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               [(key, digest, len(data), iid, str(doy), now) for key in keys])
+        self._trim(connection)
+        return digest
+
+    def _bytes(self, connection):
+        return connection.execute('SELECT COALESCE(SUM(size), 0) FROM '
+                                  '(SELECT MAX(size) AS size FROM chips GROUP BY digest)').fetchone()[0]
+
+    def _trim(self, connection):
+        total = self._bytes(connection)
+        if total <= self.maxBytes:
+            return
+        # drop about a tenth more than needed, so the next puts do not trim again
+        target = self.maxBytes * 0.9
+        evicted = 0
+        for key, digest, size in connection.execute('SELECT key, digest, size FROM chips '
+                                                    'ORDER BY accessed').fetchall():
+            connection.execute('DELETE FROM chips WHERE key = ?', (key,))
+            evicted += 1
+            if connection.execute('SELECT 1 FROM chips WHERE digest = ?', (digest,)).fetchone() is None:
+                try:
+                    os.remove(self._file(digest))
+                except OSError:
+                    pass
+                total -= size
+                if total <= target:
+                    break
+        self._count('evicted', evicted)
+
+    def getStats(self):
+        stats = dict(self.stats)
+        connection = self._connect()
+        stats['size'] = connection.execute('SELECT COUNT(*) FROM chips').fetchone()[0]
+        stats['bytes'] = self._bytes(connection)
+        return stats
+
+
+chipCache = None
+
+
+def configure(path=None, maxBytes=None):
+    global chipCache
+    if path:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        chipCache = ChipCache(path, int(maxBytes or 536870912))
+
+
+def chipKey(point, *parts):
+    """ Key of a chip: the point is reduced to the id of its Landsat pixel
+    and the user session is part of it, as in the other caches. """
+    return gee.cache.hashKey('chip', gee.pixel.snapPoint(point)[0], parts, gee.session.currentSessionKey())
+
+
+def getChip(compute, point, vis, size, iid=None, year=None, day=None):
+    """ {data, etag, iid, doy} of the chip of image iid, or of the image
+    picked for year and day, at point, with the chip_url it was downloaded
+    from when it was not cached. EE thumbnail urls expire, so they are not
+    cached with the png.
+
+    compute() returns the {iid, doy, chip_url} of createChip, the png at
+    chip_url is downloaded and cached under (iid, point, vis, size), and also
+    under (point, year, day, vis, size) for a past year, whose pick no longer
+    changes.
+    """
+    if iid is not None:
+        keys = [chipKey(point, iid, vis, size)]
+    elif year < datetime.date.today().year:
+        keys = [chipKey(point, year, day, vis, size)]
+    else:
+        keys = []
+    if chipCache is not None and keys:
+        entry = chipCache.get(keys[0])
+        if entry is not None:
+            return entry
+    values = compute()
+    fp = urllib.request.urlopen(values.get('chip_url'))
+    try:
+        data = fp.read()
+    finally:
+        fp.close()
+    entry = {'data': data, 'etag': hashlib.sha256(data).hexdigest(), 'iid': values.get('iid'),
+             'doy': values.get('doy'), 'chip_url': values.get('chip_url')}
+    if chipCache is not None:
+        keys.append(chipKey(point, values.get('iid'), vis, size))
+        try:
+            chipCache.put(keys, data, entry['iid'], entry['doy'])
+        except Exception as e:
+            logger.error("******chip cache error************ " + str(e))
+    return entry
+
+
+def getChipCacheStats():
+    if chipCache is None:
+        return {}
+    return chipCache.getStats()
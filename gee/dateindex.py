@@ -0,0 +1,36 @@
+import os
+import gee.cache
+import gee.tsstore
+
+# The index is a TimeSeriesStore of [timestamp, 'YYYY-MM-DD'] points: it keeps
+# one contiguous date range per (collection, area of interest polygon) and only
+# asks EE for the dates after the last indexed ones (and the late scenes of the
+# lookback days).
+collectionDateIndex = None
+
+
+def configure(path=None, lookbackDays=None):
+    global collectionDateIndex
+    if path:
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        collectionDateIndex = gee.tsstore.TimeSeriesStore(path, int(lookbackDays or 30))
+
+
+def datesInRange(collection, coords, start, end, compute):
+    """ Sorted acquisition dates of collection over the polygon coords in
+    [start, end), from the index when one is configured. compute(start, end)
+    must return the sorted 'YYYY-MM-DD' dates of a sub range. """
+    if collectionDateIndex is None or not start or not end:
+        return compute(start, end)
+
+    def computePoints(dateFrom, dateTo):
+        return [[gee.tsstore.toMillis(date), date] for date in compute(dateFrom, dateTo)]
+    key = gee.cache.hashKey('collectionDates', collection, coords)
+    return [date for _, date in collectionDateIndex.get(key, start[:10], end[:10], computePoints)]
+
+
+def getDateIndexStats():
+    if collectionDateIndex is None:
+        return {}
+    return collectionDateIndex.getStats()
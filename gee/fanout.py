@@ -0,0 +1,140 @@
+import collections
+import concurrent.futures
+import datetime
+import threading
+import logging
+from logging.handlers import RotatingFileHandler
+import gee.session
+
+logger = logging.getLogger(__name__)
+handler = RotatingFileHandler('gee-gateway-nginx.log', maxBytes=10485760, backupCount=10)
+logger.addHandler(handler)
+logger.setLevel(logging.DEBUG)
+
+# Shared by all requests of the process, so it also bounds how many EE calls
+# a worker has in flight at once.
+_executor = None
+_executorLock = threading.Lock()
+_maxWorkers = 8
+_inWorker = threading.local()
+
+# length, in years, of the date windows long time series are split into
+yearsPerWindow = 5
+
+
+def configure(maxWorkers=None, years=None):
+    global _maxWorkers, yearsPerWindow
+    if maxWorkers:
+        _maxWorkers = int(maxWorkers)
+    if years:
+        yearsPerWindow = int(years)
+
+
+def _getExecutor():
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=_maxWorkers)
+        return _executor
+
+
+def _run(state, fn, args):
+    _inWorker.active = True
+    try:
+        with gee.session.boundSession(state):
+            return fn(*args)
+    finally:
+        _inWorker.active = False
+
+
+def _submitAll(fn, argsList):
+    state = gee.session.currentSession()
+    executor = _getExecutor()
+    return [executor.submit(_run, state, fn, args) for args in argsList]
+
+
+def _cancel(futures):
+    for future in futures:
+        future.cancel()
+
+
+def fanOutAsCompleted(fn, argsList):
+    """ Run fn(*args) for every args of argsList in the shared pool, bound to
+    the caller's EE session, and yield (args, result) as they complete.
+    Called from a pool thread it runs serially instead, so nested fan-outs
+    cannot starve the pool. """
+    if getattr(_inWorker, 'active', False):
+        for args in argsList:
+            yield args, fn(*args)
+        return
+    futures = _submitAll(fn, argsList)
+    argsOf = dict((future, args) for future, args in zip(futures, argsList))
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            yield argsOf[future], future.result()
+    finally:
+        _cancel(futures)
+
+
+def fanOut(fn, argsList):
+    """ [fn(*args) for args in argsList], computed as fanOutAsCompleted does. """
+    if getattr(_inWorker, 'active', False):
+        return [fn(*args) for args in argsList]
+    futures = _submitAll(fn, argsList)
+    try:
+        return [future.result() for future in futures]
+    finally:
+        _cancel(futures)
+
+
+def inBackground(fn, argsList, workers=2):
+    """ Run fn(*args) for every args of argsList, in order, in the shared pool
+    and bound to the caller's EE session, without waiting for them. At most
+    `workers` of them run at once, so background work leaves the rest of the
+    pool to requests. Errors are only logged. """
+    pending = collections.deque(argsList)
+
+    def drain():
+        while True:
+            try:
+                args = pending.popleft()
+            except IndexError:
+                return
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.warning("background %s%s failed: %s" % (getattr(fn, '__name__', fn), args, str(e)))
+
+    state = gee.session.currentSession()
+    executor = _getExecutor()
+    for _ in range(min(int(workers), len(pending))):
+        executor.submit(_run, state, drain, ())
+
+
+def yearWindows(dateFrom, dateTo, years=None):
+    """ Split [dateFrom, dateTo) ('YYYY-MM-DD') into windows of at most
+    `years` years (yearsPerWindow by default) ending on January 1st. """
+    years = years or yearsPerWindow
+    windows = []
+    start = dateFrom[:10]
+    dateTo = dateTo[:10]
+    while start < dateTo:
+        end = min('%04d-01-01' % (int(start[:4]) + years), dateTo)
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+def byWindow(compute, dateFrom, dateTo, years=None):
+    """ Yield (windowFrom, windowTo, compute(windowFrom, windowTo)) for every
+    window of [dateFrom, dateTo) as soon as it is computed. Without a date
+    range compute runs once over the whole of it. """
+    if not dateFrom or not dateTo:
+        yield dateFrom, dateTo, compute(dateFrom, dateTo)
+        return
+    for (windowFrom, windowTo), result in fanOutAsCompleted(compute, yearWindows(dateFrom, dateTo, years)):
+        yield windowFrom, windowTo, result
+
+
+def tomorrow():
+    return (datetime.date.today() + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
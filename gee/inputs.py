@@ -63,50 +63,20 @@ def getLandsat(options):
             useMask = False
         logger.error("all options set")
         logger.error("start, end" + start + ", " + end)
-        # Filter using new filtering functions
-        col = None
-        fcollection4 = ee.ImageCollection('LANDSAT/LT04/C01/T1_SR').filterDate(start, end).filterBounds(region)
-        f4size = fcollection4.size().getInfo()
-        if f4size > 0:
-            collection4 = fcollection4.map(prepareL4L5, True).sort('system:time_start')
-            col = collection4
-        fcollection5 = ee.ImageCollection('LANDSAT/LT05/C01/T1_SR').filterDate(start, end).filterBounds(region)
-        f5size = fcollection5.size().getInfo()
-        if f5size > 0:
-            logger.error("inside f5size")
-            collection5 = fcollection5.map(prepareL4L5, True).sort('system:time_start')
-            if col is None:
-                col = collection5
-            else:
-                col = col.merge(collection5)
-        fcollection7 = ee.ImageCollection('LANDSAT/LE07/C01/T1_SR').filterDate(start, end).filterBounds(region)
-        f7size = fcollection7.size().getInfo()
-        if f7size > 0:
-            collection7 = fcollection7.map(prepareL7, True).sort('system:time_start')
-            if col is None:
-                col = collection7
-            else:
-                col = col.merge(collection7)
-        fcollection8 = ee.ImageCollection('LANDSAT/LC08/C01/T1_SR').filterDate(start, end).filterBounds(region)
-        f8size = fcollection8.size().getInfo()
-        if fcollection8.size().getInfo() > 0:
-            collection8 = fcollection8.map(prepareL8, True).sort('system:time_start')
-            if col is None:
-                col = collection8
-            else:
-                col = col.merge(collection8)
-
-        if region is not None:
-            col = col.filterBounds(region)
+        # Only the sensors that are in sensors (whatever their value, as the
+        # SATELLITE filters did) and acquired scenes in [start, end) are merged.
+        # Empty collections are fine server side, so nothing is probed.
+        col = ee.ImageCollection([])
+        for key, (name, first, last, prepare) in LANDSAT_SENSORS.items():
+            if key not in sensors:
+                continue
+            if end <= first or (last is not None and start > last):
+                continue
+            collection = ee.ImageCollection(name).filterDate(start, end)
+            if region is not None:
+                collection = collection.filterBounds(region)
+            col = col.merge(collection.map(prepare, True).sort('system:time_start'))
         indices = doIndices(col).select(targetBands)
-        if "l5" not in sensors:
-            indices = indices.filterMetadata('SATELLITE','not_equals','LANDSAT_5')
-        if "l4" not in sensors:
-            indices = indices.filterMetadata('SATELLITE','not_equals','LANDSAT_4')
-        if "l7" not in sensors:
-            indices = indices.filterMetadata('SATELLITE','not_equals','LANDSAT_7')
-        if "l8" not in sensors:
-            indices = indices.filterMetadata('SATELLITE','not_equals','LANDSAT_8')
         indices = indices.filter(ee.Filter.dayOfYear(startDOY, endDOY))
     return ee.ImageCollection(indices)
 
@@ -464,6 +434,14 @@ def prepareL8(image):
     # combined = ee.Image(image).addBands(scaled).updateMask(mask1.And(mask2).And(mask3).And(mask4))
     # return combined.copyProperties(image).set('system:time_start', image.get('system:time_start'))
 
+# sensor key -> (SR collection, first and last day with scenes, prepare function)
+LANDSAT_SENSORS = {
+    'l4': ('LANDSAT/LT04/C01/T1_SR', '1982-08-22', '1993-12-14', prepareL4L5),
+    'l5': ('LANDSAT/LT05/C01/T1_SR', '1984-03-16', '2012-05-05', prepareL4L5),
+    'l7': ('LANDSAT/LE07/C01/T1_SR', '1999-05-28', None, prepareL7),
+    'l8': ('LANDSAT/LC08/C01/T1_SR', '2013-03-18', None, prepareL8)
+}
+
 def generateCollection(geom, startDate, endDate):
     filteredL8 = (ee.ImageCollection('LANDSAT/LC08/C01/T1_SR') \
                       .filter("WRS_ROW < 122") \
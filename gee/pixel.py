@@ -0,0 +1,92 @@
+""" Snapping of lon/lat points to the 30 m Landsat pixel grid of their UTM
+zone, with the WGS84 transverse Mercator series of Snyder's Map Projections
+- A Working Manual (USGS 1395), accurate to well under a millimeter within
+a zone. """
+import math
+
+A = 6378137.0
+F = 1 / 298.257223563
+E2 = F * (2 - F)
+EP2 = E2 / (1 - E2)
+K0 = 0.9996
+FALSE_EASTING = 500000.0
+FALSE_NORTHING_SOUTH = 10000000.0
+M1 = 1 - E2 / 4 - 3 * E2 ** 2 / 64 - 5 * E2 ** 3 / 256
+M2 = 3 * E2 / 8 + 3 * E2 ** 2 / 32 + 45 * E2 ** 3 / 1024
+M3 = 15 * E2 ** 2 / 256 + 45 * E2 ** 3 / 1024
+M4 = 35 * E2 ** 3 / 3072
+E1 = (1 - math.sqrt(1 - E2)) / (1 + math.sqrt(1 - E2))
+
+# Landsat products put their pixel centers on multiples of 30 m
+PIXEL_SIZE = 30
+
+
+def utmZone(lon):
+    return int((lon + 180) // 6) % 60 + 1
+
+
+def centralMeridian(zone):
+    return zone * 6 - 183
+
+
+def toUtm(lon, lat, zone=None):
+    """ (zone, north, easting, northing) of a WGS84 lon/lat. """
+    zone = zone or utmZone(lon)
+    phi = math.radians(lat)
+    sinPhi = math.sin(phi)
+    cosPhi = math.cos(phi)
+    n = A / math.sqrt(1 - E2 * sinPhi ** 2)
+    t = math.tan(phi) ** 2
+    c = EP2 * cosPhi ** 2
+    a = cosPhi * math.radians(lon - centralMeridian(zone))
+    m = A * (M1 * phi - M2 * math.sin(2 * phi) + M3 * math.sin(4 * phi) - M4 * math.sin(6 * phi))
+    easting = FALSE_EASTING + K0 * n * (a + (1 - t + c) * a ** 3 / 6 +
+                                        (5 - 18 * t + t ** 2 + 72 * c - 58 * EP2) * a ** 5 / 120)
+    northing = K0 * (m + n * math.tan(phi) * (a ** 2 / 2 + (5 - t + 9 * c + 4 * c ** 2) * a ** 4 / 24 +
+                                              (61 - 58 * t + t ** 2 + 600 * c - 330 * EP2) * a ** 6 / 720))
+    if lat < 0:
+        northing += FALSE_NORTHING_SOUTH
+    return zone, lat >= 0, easting, northing
+
+
+def fromUtm(zone, north, easting, northing):
+    """ WGS84 (lon, lat) of UTM coordinates. """
+    if not north:
+        northing -= FALSE_NORTHING_SOUTH
+    mu = northing / K0 / (A * M1)
+    phi1 = (mu + (3 * E1 / 2 - 27 * E1 ** 3 / 32) * math.sin(2 * mu) +
+            (21 * E1 ** 2 / 16 - 55 * E1 ** 4 / 32) * math.sin(4 * mu) +
+            (151 * E1 ** 3 / 96) * math.sin(6 * mu) +
+            (1097 * E1 ** 4 / 512) * math.sin(8 * mu))
+    sinPhi1 = math.sin(phi1)
+    cosPhi1 = math.cos(phi1)
+    c1 = EP2 * cosPhi1 ** 2
+    t1 = math.tan(phi1) ** 2
+    n1 = A / math.sqrt(1 - E2 * sinPhi1 ** 2)
+    r1 = A * (1 - E2) / (1 - E2 * sinPhi1 ** 2) ** 1.5
+    d = (easting - FALSE_EASTING) / (n1 * K0)
+    phi = phi1 - (n1 * math.tan(phi1) / r1) * (
+        d ** 2 / 2 - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * EP2) * d ** 4 / 24 +
+        (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * EP2 - 3 * c1 ** 2) * d ** 6 / 720)
+    lam = (d - (1 + 2 * t1 + c1) * d ** 3 / 6 +
+           (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * EP2 + 24 * t1 ** 2) * d ** 5 / 120) / cosPhi1
+    return centralMeridian(zone) + math.degrees(lam), math.degrees(phi)
+
+
+def snapPoint(point, size=PIXEL_SIZE):
+    """ (pixel id, (lon, lat) of the pixel center) of the Landsat pixel of its
+    UTM zone that contains point, e.g. ('32610/18721/139462', (-122.299943401, 37.800038281))
+    for (-122.3, 37.8). The id is the EPSG code, column and row of the pixel.
+    Landsat puts southern scenes on the north zone grid too, with negative
+    northings, so rows are counted without the southern false northing.
+    Points outside the UTM latitudes are returned as they are. """
+    lon, lat = float(point[0]), float(point[1])
+    if not -80 <= lat <= 84:
+        return '%.6f/%.6f' % (lon, lat), (lon, lat)
+    zone, north, easting, northing = toUtm(lon, lat)
+    if not north:
+        northing -= FALSE_NORTHING_SOUTH
+    column = int(round(easting / size))
+    row = int(round(northing / size))
+    center = fromUtm(zone, True, column * size, row * size)
+    return '%d/%d/%d' % (32600 + zone, column, row), (round(center[0], 9), round(center[1], 9))
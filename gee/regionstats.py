@@ -0,0 +1,136 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import logging
+from logging.handlers import RotatingFileHandler
+import gee.cache
+
+logger = logging.getLogger(__name__)
+handler = RotatingFileHandler('gee-gateway-nginx.log', maxBytes=10485760, backupCount=10)
+logger.addHandler(handler)
+logger.setLevel(logging.DEBUG)
+
+
+class RegionStatisticsStore(object):
+    """ Statistics of the named regions (basins, landscapes...) in a local
+    SQLite file shared by the processes on the node.
+
+    Every process runs a background thread that recomputes a region type
+    once its results are older than refreshInterval seconds, so requests only
+    ever read the table. A lock file next to the table lets only one process
+    at a time refresh it.
+    """
+
+    def __init__(self, path, refreshInterval=86400):
+        self.path = path
+        self.refreshInterval = refreshInterval
+        self._lock = threading.Lock()
+        self._pid = None
+        self.stats = {'hits': 0, 'misses': 0, 'refreshed': 0, 'errors': 0}
+        self._connect().execute('CREATE TABLE IF NOT EXISTS statistics ('
+                                'param_type TEXT, name TEXT, value TEXT, computed REAL, '
+                                'PRIMARY KEY (param_type, name))')
+
+    def _connect(self):
+        return gee.cache.connectSqlite(self.path)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, paramType, name):
+        row = self._connect().execute('SELECT value FROM statistics WHERE param_type = ? AND name = ?',
+                                      (paramType, str(name))).fetchone()
+        self._count('misses' if row is None else 'hits')
+        return None if row is None else json.loads(row[0])
+
+    def put(self, paramType, valuesByName):
+        now = time.time()
+        connection = self._connect()
+        connection.execute('BEGIN')
+        try:
+            connection.execute('DELETE FROM statistics WHERE param_type = ?', (paramType,))
+            connection.executemany('INSERT INTO statistics VALUES (?, ?, ?, ?)',
+                                   [(paramType, str(name), json.dumps(values), now)
+                                    for name, values in valuesByName.items()])
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def age(self, paramType):
+        """ Seconds since paramType was computed, None if it never was. """
+        row = self._connect().execute('SELECT MIN(computed) FROM statistics WHERE param_type = ?',
+                                      (paramType,)).fetchone()
+        return None if row[0] is None else time.time() - row[0]
+
+    def refresh(self, paramTypes, compute):
+        """ compute(paramType) -> {name: values} of every stale paramType,
+        unless another process is already refreshing the table. """
+        with open(self.path + '.lock', 'w') as lockFile:
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return
+            try:
+                for paramType in paramTypes:
+                    age = self.age(paramType)
+                    if age is not None and age < self.refreshInterval:
+                        continue
+                    try:
+                        self.put(paramType, compute(paramType))
+                        self._count('refreshed')
+                    except Exception as e:
+                        self._count('errors')
+                        logger.error("******region statistics refresh error************ %s: %s" %
+                                     (paramType, str(e)))
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def ensureRefreshing(self, paramTypes, compute):
+        """ Start the refresh thread of this process, once per (forked) process. """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        def refreshForever():
+            while True:
+                self.refresh(paramTypes, compute)
+                time.sleep(min(self.refreshInterval, 3600))
+        thread = threading.Thread(target=refreshForever, name='region-statistics')
+        thread.daemon = True
+        thread.start()
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['size'] = self._connect().execute('SELECT COUNT(*) FROM statistics').fetchone()[0]
+        return stats
+
+
+regionStatisticsStore = None
+
+
+def configure(path=None, refreshInterval=None):
+    global regionStatisticsStore
+    if path:
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        regionStatisticsStore = RegionStatisticsStore(path, int(refreshInterval or 86400))
+
+
+def lookup(paramType, name, paramTypes, compute):
+    """ Precomputed statistics of the region name of paramType, None when the
+    store is not configured or does not hold them (yet). """
+    if regionStatisticsStore is None:
+        return None
+    regionStatisticsStore.ensureRefreshing(paramTypes, compute)
+    return regionStatisticsStore.get(paramType, name)
+
+
+def getRegionStatisticsStats():
+    if regionStatisticsStore is None:
+        return {}
+    return regionStatisticsStore.getStats()
@@ -0,0 +1,119 @@
+import collections
+import datetime
+import math
+import re
+import logging
+from logging.handlers import RotatingFileHandler
+from shapely.geometry import Polygon
+from ee.ee_exception import EEException
+
+logger = logging.getLogger(__name__)
+handler = RotatingFileHandler('gee-gateway-nginx.log', maxBytes=10485760, backupCount=10)
+logger.addHandler(handler)
+logger.setLevel(logging.DEBUG)
+
+METERS_PER_DEGREE = 111319.49
+
+# pixels a single reduceRegion may read, the EE default maxPixels
+maxPixels = 1e7
+# coarser scale retries of a reduction that still hits an EE limit
+retries = 2
+# values a getRegion call may return
+GET_REGION_LIMIT = 1048576
+# EE error messages worth a retry with a coarser scale
+RESOURCE_ERRORS = ('Too many pixels', 'Too many values', 'memory limit', 'Computed value is too large')
+
+
+class ScalePlan(collections.namedtuple('ScalePlan', ['scale', 'tileScale', 'maxPixels', 'pixels'])):
+    """ Parameters of a reduction and the pixels it is expected to read. """
+
+    def coarser(self, factor=2):
+        return ScalePlan(self.scale * factor, min(16, self.tileScale * 2), self.maxPixels,
+                         self.pixels / float(factor) ** 2)
+
+
+def configure(maxPixelCount=None, retryCount=None):
+    global maxPixels, retries
+    if maxPixelCount:
+        maxPixels = float(maxPixelCount)
+    if retryCount is not None:
+        retries = int(retryCount)
+
+
+def estimatePixels(coords, scale):
+    """ Pixels of scale meters in the polygon coords, 1 for a point. """
+    if not isinstance(coords[0], list):
+        return 1
+    ring = coords[0] if isinstance(coords[0][0], list) else coords
+    polygon = Polygon(ring)
+    area = polygon.area * METERS_PER_DEGREE ** 2 * math.cos(math.radians(polygon.centroid.y))
+    return max(1, area / float(scale) ** 2)
+
+
+def plan(coords, scale, budget=None):
+    """ Scale and tileScale reading at most budget (maxPixels by default)
+    pixels of the polygon: the scale doubles until the estimate fits, the
+    tileScale grows by 2 for every 4x over one million pixels. """
+    budget = budget or maxPixels
+    requested = scale
+    scale = float(scale)
+    pixels = estimatePixels(coords, scale)
+    while pixels > budget:
+        scale *= 2
+        pixels /= 4.0
+    if scale != float(requested):
+        logger.warning("%d pixels at scale %s exceed %d, reducing at scale %s" %
+                       (estimatePixels(coords, requested), requested, budget, scale))
+    tileScale = 1
+    while tileScale < 16 and pixels > 1e6 * tileScale ** 2:
+        tileScale *= 2
+    return ScalePlan(scale, tileScale, budget, pixels)
+
+
+def planRegion(coords, scale, dateFrom=None, dateTo=None):
+    """ plan for a getRegion call, whose limit is on pixels times images. The
+    number of images is not known before the call, so the requested scale is
+    kept and only coarsened by withRetry when EE reports the limit exceeded.
+    pixels is an estimate with about an image every 8 days (two sensors in
+    orbit). """
+    dateFrom = dateFrom or '1984-01-01'
+    dateTo = dateTo or datetime.date.today().strftime('%Y-%m-%d')
+    days = (datetime.datetime.strptime(dateTo[:10], '%Y-%m-%d') -
+            datetime.datetime.strptime(dateFrom[:10], '%Y-%m-%d')).days
+    images = max(1, days / 8.0)
+    return ScalePlan(float(scale), 1, GET_REGION_LIMIT, estimatePixels(coords, scale) * images)
+
+
+def isResourceError(e):
+    return any(message in str(e) for message in RESOURCE_ERRORS)
+
+
+def coarseningFactor(e):
+    """ Scale factor bringing a reduction under the limit EE reported, from
+    the first two large numbers of its message (e.g. the values requested and
+    the limit), between 1.25 and 8, 2 when the message does not give them. """
+    numbers = [int(n) for n in re.findall(r'\d+', str(e)) if int(n) >= 1000][:2]
+    if len(numbers) == 2 and numbers[0] != numbers[1]:
+        return min(8.0, max(1.25, math.sqrt(max(numbers) / float(min(numbers))) * 1.05))
+    return 2
+
+
+def withRetry(compute, scalePlan, name=''):
+    """ compute(scalePlan), retried at most `retries` times with a coarser
+    scale when EE rejects the reduction for its size. The scale used is
+    logged when it is not the planned one. """
+    planned = scalePlan.scale
+    for attempt in range(retries + 1):
+        try:
+            result = compute(scalePlan)
+            if scalePlan.scale != planned:
+                logger.warning("%s computed at scale %s instead of %s" % (name, scalePlan.scale, planned))
+            return result
+        except EEException as e:
+            if attempt == retries or not isResourceError(e):
+                raise
+            coarser = scalePlan.coarser(coarseningFactor(e))
+            logger.warning("%s failed at scale %s tileScale %s (%s), retrying at scale %s tileScale %s" %
+                           (name, scalePlan.scale, scalePlan.tileScale, str(e),
+                            coarser.scale, coarser.tileScale))
+            scalePlan = coarser
@@ -0,0 +1,220 @@
+import base64
+import numpy as np
+from gee.gee_exception import GEEException
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DAY_MS = 86400000
+
+DAY_REDUCERS = ('mean', 'median', 'min', 'max')
+
+# response formats of the time series endpoints, see formatTimeSeries
+FORMATS = ('rows', 'columnar', 'packed', 'msgpack')
+
+
+def toArrays(points):
+    """ [[timestamp, value], ...] as int64 timestamps and float64 values, None as nan. """
+    if not len(points):
+        return np.empty(0, np.int64), np.empty(0, np.float64)
+    times, values = zip(*points)
+    return np.array(times, np.int64), np.array(values, np.float64)
+
+
+def toPoints(times, values):
+    """ [[timestamp, value], ...] of the two arrays. """
+    return [list(point) for point in zip(times.tolist(), values.tolist())]
+
+
+def aggregateByDay(times, values, reducer='mean'):
+    """ Reduce the values of each UTC day with mean, median, min or max.
+
+    times are epoch milliseconds, values floats with nan for no data. Returns
+    the sorted timestamps of the midnights of the days with data and their
+    reduced values.
+    """
+    times = np.asarray(times, np.int64)
+    values = np.asarray(values, np.float64)
+    valid = ~np.isnan(values)
+    days = times[valid] // DAY_MS
+    values = values[valid]
+    if not len(days):
+        return days, values
+    # sorted by day, then by value for the median
+    order = np.lexsort((values, days))
+    days = days[order]
+    values = values[order]
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    counts = np.diff(np.r_[starts, len(days)])
+    if reducer == 'max':
+        reduced = values[starts + counts - 1]
+    elif reducer == 'min':
+        reduced = values[starts]
+    elif reducer == 'median':
+        reduced = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+    else:
+        reduced = np.add.reduceat(values, starts) / counts
+    return days[starts] * DAY_MS, reduced
+
+
+def aggregateRegion(regionList, reducer='mean'):
+    """ Daily series of the last band of an ee getRegion result: the header
+    row followed by [id, longitude, latitude, time, ..., value] rows. """
+    if len(regionList) < 2:
+        return []
+    timeColumn = regionList[0].index('time')
+    rows = regionList[1:]
+    times = np.array([row[timeColumn] for row in rows], np.int64)
+    values = np.array([row[-1] for row in rows], np.float64)
+    return toPoints(*aggregateByDay(times, values, reducer))
+
+
+def rowsToColumns(names, rows):
+    """ {name: [values]} of rows of values in names order. """
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    return dict((name, list(column)) for name, column in zip(names, columns))
+
+
+def toColumns(timeseries):
+    """ Columns of a time series given as [[timestamp, value], ...], as a list
+    of dicts or already as columns. """
+    if isinstance(timeseries, dict):
+        return timeseries
+    if timeseries and isinstance(timeseries[0], dict):
+        names = list(timeseries[0])
+        return rowsToColumns(names, [[row.get(name) for name in names] for row in timeseries])
+    return rowsToColumns(['time', 'value'], timeseries or [])
+
+
+def packColumn(values, binary=False):
+    """ Integer columns as little-endian int32 or int64, numeric columns with
+    gaps as float32 with nan for None, in base64 unless binary. Other columns
+    are returned as they are. """
+    kinds = set(type(value) for value in values)
+    if kinds and kinds <= {int}:
+        array = np.array(values, np.int64)
+        if array.min() >= -2 ** 31 and array.max() < 2 ** 31:
+            array = array.astype('<i4')
+        else:
+            array = array.astype('<i8')
+    elif kinds and kinds <= {int, float, type(None)}:
+        array = np.array(values, np.float64).astype('<f4')
+    else:
+        return values
+    data = array.tobytes()
+    return {'dtype': array.dtype.name, 'data': data if binary else base64.b64encode(data).decode('ascii')}
+
+
+def formatTimeSeries(timeseries, responseFormat='rows'):
+    """ timeseries in one of FORMATS:
+
+        rows      as computed, [[timestamp, value], ...] or a list of dicts
+        columnar  {name: [values]}, e.g. {time: [...], value: [...]}
+        packed    {name: {dtype, data}} with the base64 of the packed column
+        msgpack   packed, with raw bytes instead of base64, see toMsgpack
+    """
+    if responseFormat == 'columnar':
+        return toColumns(timeseries)
+    elif responseFormat in ('packed', 'msgpack'):
+        binary = responseFormat == 'msgpack'
+        return dict((name, packColumn(column, binary)) for name, column in toColumns(timeseries).items())
+    return timeseries
+
+
+def toMsgpack(values):
+    if msgpack is None:
+        raise GEEException("msgpack format requested but the msgpack package is not installed")
+    return msgpack.packb(values, use_bin_type=True)
+
+
+def lttb(times, values, maxPoints):
+    """ Indices of the maxPoints points Largest-Triangle-Three-Buckets keeps
+    of the series, always including its first and last points, and the
+    boundaries of its buckets. maxPoints must be at least 3 and less than
+    the length of the series. """
+    size = len(times)
+    times = np.asarray(times, np.float64)
+    values = np.asarray(values, np.float64)
+    # maxPoints - 2 buckets between the first and the last point
+    edges = np.append(np.linspace(1, size - 1, maxPoints - 1).astype(np.int64)[:-1], size - 1)
+    selected = np.empty(maxPoints, np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    previous = 0
+    for bucket in range(maxPoints - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        nextEnd = edges[bucket + 2] if bucket + 2 < len(edges) else size
+        nextTime = times[end:nextEnd].mean()
+        nextValue = values[end:nextEnd].mean()
+        areas = np.abs((times[previous] - nextTime) * (values[start:end] - values[previous]) -
+                       (times[previous] - times[start:end]) * (nextValue - values[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected, edges
+
+
+def downsample(points, maxPoints):
+    """ maxPoints of a [[timestamp, value], ...] series, picked by LTTB. The
+    minimum and maximum are always kept, in place of the point LTTB picked in
+    their bucket (so one more point when both fall in the same bucket).
+    Points without value are dropped. Other series, or series already short
+    enough, are returned as they are. maxPoints below 3 (the first, the last
+    and one point between) counts as 3. """
+    if not maxPoints:
+        return points
+    maxPoints = max(3, int(maxPoints))
+    if isinstance(points, dict) or len(points) <= maxPoints or not isinstance(points[0], (list, tuple)):
+        return points
+    times, values = toArrays(points)
+    valid = ~np.isnan(values)
+    times = times[valid]
+    values = values[valid]
+    if len(times) <= maxPoints:
+        return toPoints(times, values)
+    selected, edges = lttb(times, values, maxPoints)
+    extrema = [int(np.argmin(values)), int(np.argmax(values))]
+    replaced = set()
+    for index in extrema:
+        if index in selected:
+            continue
+        # bucket b spans [edges[b], edges[b + 1]) and owns selected[b + 1]
+        slot = int(np.searchsorted(edges, index, side='right'))
+        if slot in replaced:
+            selected = np.insert(selected, slot + 1, index)
+        else:
+            selected[slot] = index
+            replaced.add(slot)
+    selected = np.sort(selected)
+    return toPoints(times[selected], values[selected])
+
+
+def decodeFmask(qa):
+    """ Landsat SR pixel_qa values as the modified fmask classes of parseQA2FMask:
+    0 clear, 1 water, 2 snow, 3 shadow, 4 cloud, nan where qa is nan. """
+    qa = np.asarray(qa, np.float64)
+    valid = ~np.isnan(qa)
+    bits = np.where(valid, qa, 0).astype(np.int64)
+    fmask = (bits & 2 == 0).astype(np.float64)
+    fmask[bits & 4 > 0] = 1
+    fmask[bits & 16 > 0] = 2
+    fmask[bits & 8 > 0] = 3
+    fmask[bits & 32 > 0] = 4
+    fmask[~valid] = np.nan
+    return fmask
+
+
+def yearAndDayOfYear(times):
+    """ UTC year and zero based day of the year of epoch millisecond times. """
+    days = np.asarray(times, np.int64) // DAY_MS
+    years = days.astype('datetime64[D]').astype('datetime64[Y]')
+    return years.astype(np.int64) + 1970, days - years.astype('datetime64[D]').astype(np.int64)
+
+
+def toList(array):
+    """ array as a list with None for nan. """
+    values = array.tolist()
+    if array.dtype.kind == 'f':
+        return [None if value != value else value for value in values]
+    return values
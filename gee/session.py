@@ -0,0 +1,241 @@
+import collections
+import hashlib
+import threading
+import time
+import ee
+from ee.ee_exception import EEException
+import logging.config
+from logging.handlers import RotatingFileHandler
+
+# Setup Logging
+logger = logging.getLogger(__name__)
+handler = RotatingFileHandler('gee-gateway-nginx.log', maxBytes=10485760, backupCount=10)
+logger.addHandler(handler)
+logger.setLevel(logging.DEBUG)
+
+
+class CredentialCache(object):
+    """ Per-process cache of the service account session used by ee.Initialize.
+
+    The first request of a worker builds the credentials and initializes EE,
+    later requests reuse that session and only refresh the access token when
+    it has expired.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._credentials = None
+        self.stats = {'initialized': 0, 'refreshed': 0, 'reused': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _isReusable(self, key):
+        return self._key == key and self._credentials is not None and not self._credentials.expired
+
+    def ensure(self, ee_account, ee_key_path):
+        """ Make sure EE is initialized for the given service account. """
+        key = (ee_account, ee_key_path)
+        if self._isReusable(key):
+            self._count('reused')
+            return self._credentials
+        with self._lock:
+            if self._isReusable(key):
+                self.stats['reused'] += 1
+                return self._credentials
+            if self._key == key and self._credentials is not None:
+                try:
+                    import google.auth.transport.requests
+                    self._credentials.refresh(google.auth.transport.requests.Request())
+                    self.stats['refreshed'] += 1
+                    return self._credentials
+                except Exception as e:
+                    logger.error("******EE credentials refresh error, re-initializing************ " + str(e))
+            try:
+                credentials = ee.ServiceAccountCredentials(ee_account, ee_key_path)
+                with boundSession(None):
+                    ee.Initialize(credentials)
+            except (EEException, ValueError, IOError) as e:
+                self.stats['errors'] += 1
+                self._key = None
+                self._credentials = None
+                raise EEException(str(e))
+            self._key = key
+            self._credentials = credentials
+            self.stats['initialized'] += 1
+            logger.info("EE initialized for service account " + ee_account)
+            return credentials
+
+    def reset(self):
+        """ Forget the cached session, the next request initializes EE again. """
+        with self._lock:
+            self._key = None
+            self._credentials = None
+
+
+credentialCache = CredentialCache()
+
+########################## Per-user sessions ##########################
+
+# EE keeps its credentials and HTTP resources in a single EEState object.
+# Routing ee._state.get_state through a thread local lets every request
+# thread work against its own user's state while the service account state
+# stays the process-wide default.
+_bound = threading.local()
+_processGetState = None
+
+
+def _installStateHook():
+    global _processGetState
+    if _processGetState is not None:
+        return True
+    try:
+        from ee import _state as eeState
+    except ImportError:
+        logger.error("******ee._state not available, user sessions are disabled************")
+        return False
+    _processGetState = eeState.get_state
+
+    def get_state():
+        state = getattr(_bound, 'state', None)
+        if state is not None:
+            return state
+        return _processGetState()
+    eeState.get_state = get_state
+    return True
+
+
+def currentSession():
+    """ The EE state bound to the calling thread, None for the service account. """
+    return getattr(_bound, 'state', None)
+
+
+def currentSessionKey():
+    """ Token hash of the bound user session, None for the service account. """
+    return getattr(currentSession(), 'sessionKey', None)
+
+
+def bindSession(state):
+    _bound.state = state
+
+
+def unbindSession():
+    _bound.state = None
+
+
+class boundSession(object):
+    """ Context manager binding an EE state to the current thread, used to
+    carry a request's session into worker threads. """
+
+    def __init__(self, state):
+        self.state = state
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = currentSession()
+        bindSession(self.state)
+        return self.state
+
+    def __exit__(self, *args):
+        bindSession(self._previous)
+
+
+class UserSession(object):
+    def __init__(self, state, expiresAt):
+        self.state = state
+        self.expiresAt = expiresAt
+
+    def isExpired(self, now=None):
+        return (now or time.time()) >= self.expiresAt
+
+
+class UserSessionPool(object):
+    """ LRU pool of EE sessions keyed by a hash of the user access token. """
+
+    def __init__(self, maxSize=64, ttl=3000):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+        self.stats = {'created': 0, 'reused': 0, 'expired': 0, 'evicted': 0}
+
+    @staticmethod
+    def tokenKey(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _create(self, token):
+        from google.oauth2.credentials import Credentials
+        from ee import _state as eeState
+        project = _processGetState().cloud_api_user_project
+        state = eeState.EEState()
+        state.sessionKey = self.tokenKey(token)
+        with boundSession(state):
+            ee.data.initialize(credentials=Credentials(token), project=project)
+        return state
+
+    def get(self, token, expiresAt=None):
+        """ Return the EE state for token, creating it if needed.
+
+        expiresAt is the token expiry in epoch seconds when the caller knows
+        it, otherwise the session lives for ttl seconds.
+        """
+        key = self.tokenKey(token)
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                if not session.isExpired(now):
+                    self._sessions.move_to_end(key)
+                    self.stats['reused'] += 1
+                    return session.state
+                del self._sessions[key]
+                self.stats['expired'] += 1
+        state = self._create(token)
+        with self._lock:
+            self._sessions[key] = UserSession(state, expiresAt or now + self.ttl)
+            self._sessions.move_to_end(key)
+            self.stats['created'] += 1
+            for expiredKey in [k for k, v in self._sessions.items() if v.isExpired(now)]:
+                del self._sessions[expiredKey]
+                self.stats['expired'] += 1
+            while len(self._sessions) > self.maxSize:
+                self._sessions.popitem(last=False)
+                self.stats['evicted'] += 1
+        return state
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+userSessionPool = UserSessionPool()
+
+
+def configure(poolSize=None, ttl=None):
+    if poolSize:
+        userSessionPool.maxSize = int(poolSize)
+    if ttl:
+        userSessionPool.ttl = int(ttl)
+
+
+def initialize(ee_account, ee_key_path):
+    return credentialCache.ensure(ee_account, ee_key_path)
+
+
+def bindUserSession(ee_user_token, expiresAt=None):
+    """ Bind the calling thread to the session of ee_user_token. """
+    if not _installStateHook():
+        return None
+    state = userSessionPool.get(ee_user_token, expiresAt)
+    bindSession(state)
+    return state
+
+
+def getSessionStats():
+    stats = dict(userSessionPool.stats)
+    stats['size'] = len(userSessionPool)
+    return {
+        'serviceAccount': dict(credentialCache.stats),
+        'users': stats
+    }
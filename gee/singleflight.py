@@ -0,0 +1,172 @@
+import fcntl
+import functools
+import json
+import os
+import threading
+import time
+import gee.cache
+import gee.session
+
+
+# lock files guarding the claims of the cross-process leaders, a key hashes
+# to one of them
+LOCK_STRIPES = 256
+# seconds after which the claim of a leader that never finished (its process
+# died) is taken over
+CLAIM_TIMEOUT = 600
+# seconds between two looks of a waiting process for the leader's result
+POLL_INTERVAL = 0.2
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls that share a key onto one computation.
+
+    Within a worker the first thread runs the function and the others wait
+    for its result. When lockDir is set the leaders of the different uwsgi
+    processes also coordinate through files: the first one leaves a claim
+    file for the key and computes, the others poll for the result it leaves
+    for resultTtl seconds instead of computing it again. The claims are made
+    under one of LOCK_STRIPES lock files, held only while the files are
+    checked, never during the computation. Results must be json serializable
+    then.
+    """
+
+    def __init__(self, lockDir=None, resultTtl=30):
+        self.lockDir = lockDir
+        self.resultTtl = resultTtl
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._writes = 0
+        self.stats = {'computed': 0, 'coalesced': 0, 'shared': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            if self.lockDir:
+                call.result = self._doAcrossProcesses(key, fn, args, kwargs)
+            else:
+                call.result = self._compute(fn, args, kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _compute(self, fn, args, kwargs):
+        with self._lock:
+            self.stats['computed'] += 1
+        return fn(*args, **kwargs)
+
+    def _claim(self, key):
+        """ The shared result of key, or None once the caller holds the claim
+        to compute it, or False while another process computes it. """
+        path = os.path.join(self.lockDir, key)
+        stripe = int(key[:8], 16) % LOCK_STRIPES
+        with open(os.path.join(self.lockDir, 'stripe-%03d.lock' % stripe), 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                try:
+                    if now - os.path.getmtime(path + '.json') < self.resultTtl:
+                        with open(path + '.json') as resultFile:
+                            return {'result': json.load(resultFile)}
+                except (OSError, ValueError):
+                    pass
+                try:
+                    if now - os.path.getmtime(path + '.claim') < CLAIM_TIMEOUT:
+                        return False
+                except OSError:
+                    pass
+                with open(path + '.claim', 'w') as claimFile:
+                    claimFile.write(str(os.getpid()))
+                return None
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def _doAcrossProcesses(self, key, fn, args, kwargs):
+        path = os.path.join(self.lockDir, key)
+        while True:
+            claim = self._claim(key)
+            if claim is None:
+                break
+            if claim is not False:
+                with self._lock:
+                    self.stats['shared'] += 1
+                return claim['result']
+            time.sleep(POLL_INTERVAL)
+        try:
+            result = self._compute(fn, args, kwargs)
+            with open(path + '.tmp', 'w') as resultFile:
+                json.dump(result, resultFile)
+            os.rename(path + '.tmp', path + '.json')
+        finally:
+            try:
+                os.remove(path + '.claim')
+            except OSError:
+                pass
+        self._prune()
+        return result
+
+    def _prune(self):
+        """ Every 100 writes, drop result files older than resultTtl and the
+        claims left by processes that died. """
+        self._writes += 1
+        if self._writes % 100:
+            return
+        now = time.time()
+        for name in os.listdir(self.lockDir):
+            if name.endswith('.json') or name.endswith('.claim'):
+                ttl = self.resultTtl if name.endswith('.json') else CLAIM_TIMEOUT
+                try:
+                    if os.path.getmtime(os.path.join(self.lockDir, name)) < now - ttl:
+                        os.remove(os.path.join(self.lockDir, name))
+                except OSError:
+                    pass
+
+
+singleFlight = SingleFlight()
+
+
+def configure(lockDir=None, resultTtl=None):
+    if lockDir:
+        if not os.path.isdir(lockDir):
+            os.makedirs(lockDir)
+        singleFlight.lockDir = lockDir
+    if resultTtl:
+        singleFlight.resultTtl = int(resultTtl)
+
+
+def coalesced(fn):
+    """ Decorator running identical concurrent calls of fn only once. The key is
+    the function name, its arguments and the bound user session. """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = gee.cache.hashKey(fn.__name__, args, kwargs, gee.session.currentSessionKey())
+        return singleFlight.do(key, fn, *args, **kwargs)
+    return wrapper
+
+
+def getSingleFlightStats():
+    return dict(singleFlight.stats)
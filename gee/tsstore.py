@@ -0,0 +1,120 @@
+import calendar
+import datetime
+import json
+import os
+import threading
+import time
+import gee.cache
+
+
+def toMillis(date):
+    """ 'YYYY-MM-DD' to epoch milliseconds (UTC). """
+    return calendar.timegm(datetime.datetime.strptime(date[:10], '%Y-%m-%d').timetuple()) * 1000
+
+
+def toDate(millis):
+    return datetime.datetime.utcfromtimestamp(millis / 1000.).strftime('%Y-%m-%d')
+
+
+class TimeSeriesStore(object):
+    """ Persistent store of already fetched time series.
+
+    Each key, e.g. (geometry, index, scale, reducer), keeps one contiguous
+    range [dateFrom, dateTo) with its [timestamp, value] points. A request only
+    computes the part of its range the store does not cover yet and merges
+    it in. Scenes keep arriving in EE for a while after their acquisition, so
+    the last lookbackDays before the time a range was fetched are always
+    fetched again.
+    """
+
+    def __init__(self, path, lookbackDays=30):
+        self.path = path
+        self.lookbackDays = lookbackDays
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'partial': 0, 'misses': 0}
+        self._connect().execute('CREATE TABLE IF NOT EXISTS series ('
+                                'key TEXT PRIMARY KEY, date_from INTEGER, date_to INTEGER, '
+                                'fetched REAL, points TEXT)')
+
+    def _connect(self):
+        return gee.cache.connectSqlite(self.path)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _load(self, key):
+        row = self._connect().execute('SELECT date_from, date_to, fetched, points FROM series WHERE key = ?',
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3])
+
+    def _save(self, key, dateFrom, dateTo, fetched, points):
+        self._connect().execute('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)',
+                                (key, dateFrom, dateTo, fetched, json.dumps(points)))
+
+    def get(self, key, dateFrom, dateTo, compute):
+        """ Points of key in [dateFrom, dateTo) ('YYYY-MM-DD' strings).
+
+        compute(dateFrom, dateTo) must return the [timestamp, value] points
+        of a sub range.
+        """
+        start = toMillis(dateFrom)
+        end = toMillis(dateTo)
+        now = time.time()
+        stored = self._load(key)
+        if stored is None:
+            points = compute(dateFrom, dateTo)
+            self._save(key, start, end, now, points)
+            self._count('misses')
+            return points
+        storedFrom, storedTo, fetched, points = stored
+        # the end of the stored range that no late scene can change anymore;
+        # missing ranges always extend the stored one so it stays contiguous
+        settledTo = min(storedTo, int((fetched - self.lookbackDays * 86400) * 1000))
+        ranges = []
+        if start < storedFrom:
+            ranges.append((start, storedFrom))
+        if end > settledTo:
+            ranges.append((max(settledTo, storedFrom), end))
+        if not ranges:
+            self._count('hits')
+        else:
+            self._count('partial')
+            for rangeFrom, rangeTo in ranges:
+                fresh = compute(toDate(rangeFrom), toDate(rangeTo))
+                points = [p for p in points if not rangeFrom <= p[0] < rangeTo] + fresh
+            byTime = dict((p[0], p) for p in points)
+            points = [byTime[t] for t in sorted(byTime)]
+            fetchedAt = now if end > settledTo else fetched
+            self._save(key, min(start, storedFrom), max(end, storedTo), fetchedAt, points)
+        return [p for p in points if start <= p[0] < end]
+
+    def getStats(self):
+        return dict(self.stats)
+
+
+timeSeriesStore = None
+
+
+def configure(path=None, lookbackDays=None):
+    global timeSeriesStore
+    if path:
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        timeSeriesStore = TimeSeriesStore(path, int(lookbackDays or 30))
+
+
+def incremental(key, dateFrom, dateTo, compute):
+    """ compute(dateFrom, dateTo) through the store when one is configured
+    and the request has an explicit date range. """
+    if timeSeriesStore is None or not dateFrom or not dateTo:
+        return compute(dateFrom, dateTo)
+    return timeSeriesStore.get(key, dateFrom, dateTo, compute)
+
+
+def getStoreStats():
+    if timeSeriesStore is None:
+        return {}
+    return timeSeriesStore.getStats()
@@ -1,13 +1,25 @@
 import datetime
 import ee
 from ee.ee_exception import EEException
+from functools import reduce
 from gee.gee_exception import GEEException
-from itertools import groupby
 import logging.config
 from logging.handlers import RotatingFileHandler
 import math
+import numpy as np
+import re
 import sys
+import gee.cache
+import gee.dateindex
+import gee.fanout
 import gee.inputs
+import gee.regionstats
+import gee.scale
+import gee.series
+import gee.session
+import gee.tsstore
+from gee.singleflight import coalesced
+from gee.cache import cached
 
 # Setup Logging
 logger = logging.getLogger(__name__)
@@ -16,12 +28,13 @@ logger.addHandler(handler)
 logger.setLevel(logging.DEBUG)
 
 
-def initialize(ee_account='', ee_key_path='', ee_user_token=''):
+def initialize(ee_account='', ee_key_path='', ee_user_token='', ee_token_expiry=None):
     try:
         if ee_account and ee_key_path:
             try:
-                credentials = ee.ServiceAccountCredentials(ee_account, ee_key_path)
-                ee.Initialize(credentials)
+                gee.session.initialize(ee_account, ee_key_path)
+                if ee_user_token:
+                    gee.session.bindUserSession(ee_user_token, ee_token_expiry)
 
             except EEException as e:
                 print(str(e))
@@ -31,15 +44,27 @@ def initialize(ee_account='', ee_key_path='', ee_user_token=''):
         logger.error("******EE initialize error************", sys.exc_info()[0])
         pass
 
+def getMapIdUrl(eeImage, visParams={}):
+    """ url_format of eeImage.getMapId(visParams), cached on the serialized
+    expression, the normalized visParams and the user session """
+    key = gee.cache.hashKey(eeImage.serialize(),
+                            gee.cache.normalizeVisParams(visParams),
+                            gee.session.currentSessionKey())
+    url = gee.cache.mapIdCache.get(key)
+    if url is None:
+        url = eeImage.getMapId(visParams)['tile_fetcher'].url_format
+        gee.cache.mapIdCache.set(key, url)
+    return url
+
 def imageToMapId(imageName, visParams={}):
     """  """
     try:
         logger.error('******imageToMapId************')
         eeImage = ee.Image(imageName)
-        mapId = eeImage.getMapId(visParams)
+        url = getMapIdUrl(eeImage, visParams)
         logger.error('******imageToMapId complete************')
         return {
-            'url': mapId['tile_fetcher'].url_format
+            'url': url
         }
     except EEException as e:
         logger.error("******imageToMapId error************", sys.exc_info()[0])
@@ -349,6 +374,8 @@ def filteredImageInCHIRPSToMapId(dateFrom=None, dateTo=None):
         raise GEEException(sys.exc_info()[0])
     return values
 
+@cached
+@coalesced
 def getTimeSeriesByCollectionAndIndex(collectionName, indexName, scale, coords=[], dateFrom=None, dateTo=None, reducer=None):
     """  """
     logger.error("************getTimeSeriesByCollectionAndIndex**********************")
@@ -399,26 +426,10 @@ def getTimeSeriesByCollectionAndIndex(collectionName, indexName, scale, coords=[
         raise GEEException(sys.exc_info()[0])
     return values
 
-def aggRegion(regionList):
-    """ helper function to take multiple values of region and aggregate to one value """
-    values = []
-    for i in range(len(regionList)):
-        if i != 0:
-            date = datetime.datetime.fromtimestamp(regionList[i][-2]/1000.).strftime("%Y-%m-%d")
-            values.append([date,regionList[i][-1]])
-
-    sort = sorted(values, key=lambda x: x[0])
-
-    out = []
-    for key, group in groupby(sort, key=lambda x: x[0][:10]):
-        data = list(group)
-        agg = sum(j for i, j in data if j != None)
-        dates = key.split('-')
-        timestamp = datetime.datetime(int(dates[0]),int(dates[1]),int(dates[2]))
-        if agg != 0:
-            out.append([int(timestamp.strftime('%s'))*1000,agg/float(len(data))])
-
-    return out
+def aggRegion(regionList, reducer=None):
+    """ helper function to take multiple values of region and aggregate to one value
+    per day with the mean (default), median, min or max """
+    return gee.series.aggregateRegion(regionList, reducer or 'mean')
 
 def getTimeSeriesByIndex(indexName, scale, coords=[], dateFrom=None, dateTo=None, reducer=None):
     """  """
@@ -439,37 +450,87 @@ def getTimeSeriesByIndex(indexName, scale, coords=[], dateFrom=None, dateTo=None
         elif (indexName == 'NDWI'):
             indexCollection = filteredImageNDWIToMapId(dateFrom, dateTo,True)
 
-        values = indexCollection.getRegion(geometry, scale).getInfo()
-        out = aggRegion(values)
+        def getRegion(scalePlan):
+            return indexCollection.getRegion(geometry, scalePlan.scale).getInfo()
+        values = gee.scale.withRetry(getRegion, gee.scale.planRegion(coords, scale, dateFrom, dateTo),
+                                     'getTimeSeriesByIndex')
+        out = aggRegion(values, reducer)
 
     except EEException as e:
-        try:
-            getTimeSeriesByIndex(indexName, scale * 2, coords, dateFrom, dateTo, reducer);
-        except EEException as e:
-            raise GEEException(sys.exc_info()[0])
+        raise GEEException(sys.exc_info()[0])
     return out
 
+@cached
+@coalesced
 def getTimeSeriesByIndex2(indexName, scale, coords=[], dateFrom=None, dateTo=None, reducer="median"):
-    """  """
-    bandsByCollection = {
-        'LANDSAT/LC08/C02/T1_TOA': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
-        'LANDSAT/LC08/C02/T2_TOA': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
-        'LANDSAT/LE07/C01/T1_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
-        'LANDSAT/LE07/C01/T2_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
-        'LANDSAT/LT05/C01/T1_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
-        'LANDSAT/LT05/C01/T2_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
-        'LANDSAT/LT04/C01/T1_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
-        'LANDSAT/LT04/C01/T2_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7']
-    }
-    indexes = {
-        'NDVI': '(nir - red) / (nir + red)',
-        'EVI': '2.5 * (nir - red) / (nir + 6.0 * red - 7.5 * blue + 1)',
-        'EVI2': '2.5 * (nir - red) / (nir + 2.4 * red + 1)',
-        'NDMI': '(nir - swir1) / (nir + swir1)',
-        'NDWI': '(green - nir) / (green + nir)',
-        'NBR': '(nir - swir2) / (nir + swir2)',
-        'LSAVI': '((nir - red) / (nir + red + 0.5)) * (1 + 0.5)'
-    }
+    """ Only the dates the time series store does not hold yet are computed in EE.
+    indexName can be a list of indexes, all computed in the same pass, which
+    gives {index: [[time, value], ...]} """
+    key = gee.cache.hashKey('getTimeSeriesByIndex2', indexName, scale, coords, reducer)
+    def compute(dateFrom, dateTo):
+        return computeTimeSeriesByIndex2(indexName, scale, coords, dateFrom, dateTo, reducer)
+    return splitIndexSeries(indexName, gee.tsstore.incremental(key, dateFrom, dateTo, compute))
+
+def splitIndexSeries(indexName, rows):
+    """ {index: [[time, value], ...]} of the [time, value, ...] rows of a list of
+    indexes, the rows themselves for a single index """
+    if not isinstance(indexName, list):
+        return rows
+    return dict((name, [[row[0], row[i + 1]] for row in rows if row[i + 1] is not None])
+                for i, name in enumerate(indexName))
+
+TIME_SERIES_BANDS_BY_COLLECTION = {
+    'LANDSAT/LC08/C02/T1_TOA': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
+    'LANDSAT/LC08/C02/T2_TOA': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
+    'LANDSAT/LE07/C01/T1_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
+    'LANDSAT/LE07/C01/T2_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
+    'LANDSAT/LT05/C01/T1_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
+    'LANDSAT/LT05/C01/T2_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
+    'LANDSAT/LT04/C01/T1_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7'],
+    'LANDSAT/LT04/C01/T2_TOA': ['B1', 'B2', 'B3', 'B4', 'B5', 'B7']
+}
+
+# first and last year with scenes, None while the sensor is still acquiring
+TIME_SERIES_YEARS_BY_COLLECTION = {
+    'LANDSAT/LC08/C02/T1_TOA': (2013, None),
+    'LANDSAT/LC08/C02/T2_TOA': (2013, None),
+    'LANDSAT/LE07/C01/T1_TOA': (1999, None),
+    'LANDSAT/LE07/C01/T2_TOA': (1999, None),
+    'LANDSAT/LT05/C01/T1_TOA': (1984, 2012),
+    'LANDSAT/LT05/C01/T2_TOA': (1984, 2012),
+    'LANDSAT/LT04/C01/T1_TOA': (1982, 1993),
+    'LANDSAT/LT04/C01/T2_TOA': (1982, 1993)
+}
+
+TIME_SERIES_INDEXES = {
+    'NDVI': '(nir - red) / (nir + red)',
+    'EVI': '2.5 * (nir - red) / (nir + 6.0 * red - 7.5 * blue + 1)',
+    'EVI2': '2.5 * (nir - red) / (nir + 2.4 * red + 1)',
+    'NDMI': '(nir - swir1) / (nir + swir1)',
+    'NDWI': '(green - nir) / (green + nir)',
+    'NBR': '(nir - swir2) / (nir + swir2)',
+    'LSAVI': '((nir - red) / (nir + red + 0.5)) * (1 + 0.5)'
+}
+
+def getReducer(reducer):
+    """ ee.Reducer for the mean, min, max or median (default) reducer names """
+    if reducer == "mean":
+        return ee.Reducer.mean()
+    elif reducer == "min":
+        return ee.Reducer.min()
+    elif reducer == "max":
+        return ee.Reducer.max()
+    else:
+        return ee.Reducer.median()
+
+def getIndexBandNames(indexName):
+    """ Band names of the index images: 'index', or the index names of a list of indexes """
+    return indexName if isinstance(indexName, list) else ['index']
+
+def getIndexCollection2(indexName, geometry, dateFrom=None, dateTo=None, collectionNames=None):
+    """ Cloud masked Landsat TOA collections (all of TIME_SERIES_BANDS_BY_COLLECTION
+    by default) as one 'index' band collection, sorted and distinct by
+    system:time_start. A list of index names gives one band per index. """
     def create(name):
         """  """
         def maskClouds(image):
@@ -490,15 +551,18 @@ def getTimeSeriesByIndex2(indexName, scale, coords=[], dateFrom=None, dateTo=Non
             return image.updateMask(isSet(['badPixels', 'cloud', 'shadow', 'cirrus']).Not())
         def toIndex(image):
             """  """
-            bands = bandsByCollection[name]
-            return image.expression(indexes[indexName], {
+            bands = TIME_SERIES_BANDS_BY_COLLECTION[name]
+            variables = {
                 'blue': image.select(bands[0]),
                 'green': image.select(bands[1]),
                 'red': image.select(bands[2]),
                 'nir': image.select(bands[3]),
                 'swir1': image.select(bands[4]),
                 'swir2': image.select(bands[5]),
-            }).clamp(-1, 1).rename(['index'])
+            }
+            indexNames = indexName if isinstance(indexName, list) else [indexName]
+            return ee.Image.cat([image.expression(TIME_SERIES_INDEXES[index], variables) for index in indexNames]) \
+                .clamp(-1, 1).rename(getIndexBandNames(indexName))
         def toIndexWithTimeStart(image):
             """  """
             time = image.get('system:time_start')
@@ -509,37 +573,127 @@ def getTimeSeriesByIndex2(indexName, scale, coords=[], dateFrom=None, dateTo=Non
             return ee.ImageCollection(name).filterDate(dateFrom, dateTo).filterBounds(geometry).map(toIndexWithTimeStart, True)
         else:
             return ee.ImageCollection(name).filterBounds(geometry).map(toIndexWithTimeStart, True)
-    def reduceRegion(image):
-        """  """
-        if reducer == "mean":
-            reduced = image.reduceRegion(ee.Reducer.mean(), geometry=geometry, scale=scale, maxPixels=1e6)
-        elif reducer == "min":
-            reduced = image.reduceRegion(ee.Reducer.min(), geometry=geometry, scale=scale, maxPixels=1e6)
-        elif reducer == "max":
-            reduced = image.reduceRegion(ee.Reducer.max(), geometry=geometry, scale=scale, maxPixels=1e6)
-        else:
-            reduced = image.reduceRegion(ee.Reducer.median(), geometry=geometry, scale=scale, maxPixels=1e6)
-        return ee.Feature(None, {
-            'index': reduced.get('index'),
-            'timeIndex': [image.get('system:time_start'), reduced.get('index')]
-        })
+    collection = ee.ImageCollection([])
+    for name in collectionNames or TIME_SERIES_BANDS_BY_COLLECTION:
+        collection = collection.merge(create(name))
+    return ee.ImageCollection(ee.ImageCollection(collection).sort('system:time_start').distinct('system:time_start'))
+
+def getTimeSeriesPieces(dateFrom=None, dateTo=None):
+    """ (collection name, dateFrom, dateTo) of every year window of the range
+    each source collection has scenes in, in TIME_SERIES_BANDS_BY_COLLECTION order """
+    pieces = []
+    for name in TIME_SERIES_BANDS_BY_COLLECTION:
+        firstYear, lastYear = TIME_SERIES_YEARS_BY_COLLECTION[name]
+        start = max(dateFrom or '1982-01-01', '%04d-01-01' % firstYear)
+        end = min(dateTo or gee.fanout.tomorrow(), '%04d-01-01' % (lastYear + 1) if lastYear else '9999-12-31')
+        for windowFrom, windowTo in gee.fanout.yearWindows(start, end):
+            pieces.append((name, windowFrom, windowTo))
+    return pieces
+
+def computeTimeSeriesByIndex2(indexName, scale, coords=[], dateFrom=None, dateTo=None, reducer="median"):
+    """ The range is split by source collection and year window, the pieces run
+    concurrently and are merged here, keeping the first collection's value of
+    scenes present in several of them """
+    pieces = getTimeSeriesPieces(dateFrom, dateTo)
+    args = [(indexName, scale, coords, reducer, name, pieceFrom, pieceTo) for name, pieceFrom, pieceTo in pieces]
     try:
-        geometry = None
-        if isinstance(coords[0], list):
-            geometry = ee.Geometry.Polygon(coords)
-        else:
-            geometry = ee.Geometry.Point(coords)
-        collection = ee.ImageCollection([])
-        for name in bandsByCollection:
-            collection = collection.merge(create(name))
-        values = ee.ImageCollection(ee.ImageCollection(collection).sort('system:time_start').distinct('system:time_start')) \
-            .map(reduceRegion) \
-            .filterMetadata('index', 'not_equals', None) \
-            .aggregate_array('timeIndex')
-        values = values.getInfo()
+        results = gee.fanout.fanOut(computeTimeSeriesPiece, args)
     except EEException as e:
         raise GEEException(sys.exc_info()[0])
-    return values
+    byTime = {}
+    for values in results:
+        for value in values:
+            byTime.setdefault(value[0], value)
+    return [byTime[time] for time in sorted(byTime)]
+
+def computeTimeSeriesPiece(indexName, scale, coords, reducer, collectionName, dateFrom, dateTo):
+    """ [time, index, ...] of one collection in [dateFrom, dateTo). The scale adapts to
+    the size of the polygon, and a window of several years that fails in EE for
+    another reason than its size is retried year by year. """
+    def reduceRegion(scalePlan):
+        def reduceImage(image):
+            """  """
+            reduced = image.reduceRegion(getReducer(reducer), geometry=geometry, scale=scalePlan.scale,
+                                         maxPixels=scalePlan.maxPixels, tileScale=scalePlan.tileScale)
+            properties = dict((band, reduced.get(band)) for band in bands)
+            properties['timeIndex'] = [image.get('system:time_start')] + [reduced.get(band) for band in bands]
+            return ee.Feature(None, properties)
+        return reduceImage
+    def compute(scalePlan):
+        return getIndexCollection2(indexName, geometry, dateFrom, dateTo, [collectionName]) \
+            .map(reduceRegion(scalePlan)) \
+            .filter(ee.Filter.Or(*[ee.Filter.notNull([band]) for band in bands])) \
+            .aggregate_array('timeIndex') \
+            .getInfo()
+    bands = getIndexBandNames(indexName)
+    geometry = None
+    if isinstance(coords[0], list):
+        geometry = ee.Geometry.Polygon(coords)
+    else:
+        geometry = ee.Geometry.Point(coords)
+    try:
+        return gee.scale.withRetry(compute, gee.scale.plan(coords, scale), 'getTimeSeriesByIndex2')
+    except EEException as e:
+        windows = gee.fanout.yearWindows(dateFrom, dateTo, 1)
+        if len(windows) < 2 or gee.scale.isResourceError(e):
+            raise
+        logger.error("time series piece %s %s-%s failed, retrying by year: %s" % (collectionName, dateFrom, dateTo, str(e)))
+        values = []
+        for windowFrom, windowTo in windows:
+            values.extend(computeTimeSeriesPiece(indexName, scale, coords, reducer, collectionName, windowFrom, windowTo))
+        return values
+
+@coalesced
+def getTimeSeriesByIndexBatch(indexName, scale, featureCollection, dateFrom=None, dateTo=None,
+                              reducer="median", idField='PLOTID', chunkSize=100):
+    """ Index time series of every plot of a GeoJSON FeatureCollection, keyed by
+    plot id. Each chunk of chunkSize plots is one reduceRegions pass per image
+    and one getInfo, at the scale planned for its largest plot. indexName is a
+    single index. """
+    if isinstance(indexName, list):
+        raise GEEException("the batch time series take a single indexName, not a list")
+    def plotIdOf(i, feature):
+        properties = feature.get('properties') or {}
+        return str(properties.get(idField, feature.get('id', i)))
+    def toPlot(i, feature):
+        return ee.Feature(ee.Geometry(feature['geometry']), {'plotId': plotIdOf(i, feature)})
+    def planChunk(chunk):
+        plans = [gee.scale.plan(feature['geometry']['coordinates'], scale) for feature in chunk
+                 if (feature.get('geometry') or {}).get('type') == 'Polygon']
+        return max(plans, key=lambda scalePlan: scalePlan.pixels) if plans \
+            else gee.scale.plan([0, 0], scale)
+    def reduceChunk(plots):
+        def compute(scalePlan):
+            def reduceRegions(image):
+                time = image.get('system:time_start')
+                return image.reduceRegions(collection=plots,
+                                           reducer=getReducer(reducer).setOutputs(['index']),
+                                           scale=scalePlan.scale, tileScale=scalePlan.tileScale) \
+                    .filter(ee.Filter.notNull(['index'])) \
+                    .map(lambda plot: plot.set('time', time))
+            return getIndexCollection2(indexName, plots.geometry(), dateFrom, dateTo) \
+                .map(reduceRegions) \
+                .flatten() \
+                .reduceColumns(ee.Reducer.toList(3), ['plotId', 'time', 'index']) \
+                .get('list') \
+                .getInfo()
+        return compute
+    features = featureCollection.get('features', []) if isinstance(featureCollection, dict) else featureCollection
+    timeseries = dict((plotIdOf(i, feature), []) for i, feature in enumerate(features))
+    try:
+        for start in range(0, len(features), chunkSize):
+            chunk = features[start:start + chunkSize]
+            plots = ee.FeatureCollection([toPlot(start + i, feature) for i, feature in enumerate(chunk)])
+            values = gee.scale.withRetry(reduceChunk(plots), planChunk(chunk), 'getTimeSeriesByIndexBatch')
+            for plotId, time, value in values:
+                timeseries.setdefault(plotId, []).append([time, value])
+    except EEException as e:
+        raise GEEException(sys.exc_info()[0])
+    for plotId in timeseries:
+        timeseries[plotId].sort(key=lambda point: point[0])
+    return timeseries
+
+@coalesced
 def getDegraditionTileUrlByDateS1(geometry, date, visParams):
     imDate = datetime.datetime.strptime(date, "%Y-%m-%d")
     befDate = imDate - datetime.timedelta(days=1)
@@ -561,10 +715,13 @@ def getDegraditionTileUrlByDateS1(geometry, date, visParams):
 
     selectedImage = ee.Image(selectedImage)
 
-    mapparams = selectedImage.getMapId(visParams)
-    return mapparams['tile_fetcher'].url_format
+    return getMapIdUrl(selectedImage, visParams)
 
+@cached
+@coalesced
 def getDegradationPlotsByPointS1(geometry, start, end, band):
+    """ Mean of the Sentinel-1 bands over geometry in every image, per band
+    when band is a list of them """
     if isinstance(geometry[0], list):
         geometry = ee.Geometry.Polygon(geometry)
     else:
@@ -584,8 +741,9 @@ def getDegradationPlotsByPointS1(geometry, start, end, band):
     lsd = sentinel1Data.map(myimageMapper, True)
     indexCollection2 = lsd.aggregate_array('indexValue')
     values = indexCollection2.getInfo()
-    return values
+    return splitBandSeries(band, values)
 
+@coalesced
 def getDegraditionTileUrlByDate(geometry, date, visParams):
     imDate = datetime.datetime.strptime(date, "%Y-%m-%d")
     befDate = imDate - datetime.timedelta(days=1)
@@ -605,21 +763,47 @@ def getDegraditionTileUrlByDate(geometry, date, visParams):
 
     selectedImage = landsatData.first()
     unmasked = ee.Image(selectedImage).multiply(10000).toInt16().unmask()
-    mapparams = unmasked.getMapId(visParams)
-    return mapparams['tile_fetcher'].url_format
+    return getMapIdUrl(unmasked, visParams)
+
 
+def prefetchDegraditionTileUrls(geometry, dates, visParams, nearDate=None, count=None, workers=2):
+    """ Start computing the getDegraditionTileUrlByDate urls of dates (up to
+    count of them, the nearest to nearDate first, the latest by default) in
+    the background, so they are in the map id cache when they are asked for. """
+    if not dates:
+        return []
+    nearDate = datetime.datetime.strptime((nearDate or max(dates))[:10], "%Y-%m-%d")
+    ordered = sorted(dates, key=lambda date: abs((datetime.datetime.strptime(date, "%Y-%m-%d") - nearDate).days))
+    ordered = ordered[:count] if count else ordered
+    gee.fanout.inBackground(getDegraditionTileUrlByDate, [(geometry, date, visParams) for date in ordered], workers)
+    return ordered
 
 def get_collection_dates_in_range(geometry, start, end, collection):
+    """ Dates with images of collection over the polygon geometry, through
+    the collection date index, which only asks EE for new dates """
     def get_dates(image):
         return ee.Feature(None, {'date': image.date().format('YYYY-MM-dd')})
 
-    geometry = ee.Geometry.Polygon(geometry)
-    dataset = ee.ImageCollection(collection).filterDate(start, end).filterBounds(geometry)
-    dates = dataset.map(get_dates).distinct('date').aggregate_array('date').sort()
-    return dates.getInfo()
+    def compute(start, end):
+        dataset = ee.ImageCollection(collection).filterDate(start, end).filterBounds(ee.Geometry.Polygon(geometry))
+        dates = dataset.map(get_dates).distinct('date').aggregate_array('date').sort()
+        return dates.getInfo()
+    return gee.dateindex.datesInRange(collection, geometry, start, end, compute)
+
 
+def splitBandSeries(band, rows):
+    """ {band: [[time, value], ...]} of the [time, {band: value}] rows of a
+    list of bands, the rows themselves for a single band """
+    if not isinstance(band, list):
+        return rows
+    return dict((name, [[row[0], row[1][name]] for row in rows if row[1].get(name) is not None])
+                for name in band)
 
+@cached
+@coalesced
 def getDegradationPlotsByPoint(geometry, start, end, band, sensors):
+    """ Mean of band over geometry in every Landsat image, band may be a list
+    of bands, all reduced in the same reduceRegion of each image """
     if isinstance(geometry[0], list):
         geometry = ee.Geometry.Polygon(geometry)
     else:
@@ -627,7 +811,7 @@ def getDegradationPlotsByPoint(geometry, start, end, band, sensors):
     landsatData = gee.inputs.getLandsat({
         "start": start,
         "end": end,
-        "targetBands": [band], #['SWIR1','NIR','RED','GREEN','BLUE','SWIR2','NDFI'],
+        "targetBands": band if isinstance(band, list) else [band], #['SWIR1','NIR','RED','GREEN','BLUE','SWIR2','NDFI'],
         "region": geometry,
         "sensors": sensors # {"l4": True, "l5": True, "l7": True, "l8": True}
     })
@@ -642,14 +826,13 @@ def getDegradationPlotsByPoint(geometry, start, end, band, sensors):
     lsd = landsatData.map(myimageMapper, True)
     indexCollection2 = lsd.aggregate_array('indexValue')
     values = indexCollection2.getInfo()
-    return values
+    return splitBandSeries(band, values)
 
 def getFeatureCollectionTileUrl(featureCollection, field, matchID, visParams):
     fc = ee.FeatureCollection(featureCollection)
     single = fc.filter(ee.Filter.equals(field, matchID))
     Pimage = ee.Image().paint(single,0,2)
-    iobj = Pimage.getMapId(visParams)
-    return iobj['tile_fetcher'].url_format
+    return getMapIdUrl(Pimage, visParams)
 
 def mosaicByDate(imcol):
     # imcol: An image collection
@@ -768,8 +951,12 @@ def getImagePlot(iCol, region, point, bandName, position):
         .getInfo()
     #, ee.Reducer.mean(), 30
 
-def getTimeSeriesForPoint(point, dateFrom=None, dateTo=datetime.datetime.now()):
-    """ https://code.earthengine.google.com/49592558df4df130e9082f94a23a887f """
+@cached
+def getTimeSeriesForPoint(point, dateFrom=None, dateTo=datetime.datetime.now(), columnar=False):
+    """ https://code.earthengine.google.com/49592558df4df130e9082f94a23a887f
+    columnar returns {property: [values]} instead of one dict per image """
+    if isinstance(point, (list, tuple)):
+        point = ee.Geometry.Point(point)
 
     bandNames = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2', 'temp', 'pixel_qa']
     #TODO: implement image_year and image_julday on the client side. Keep it for now for TimeSync
@@ -827,78 +1014,113 @@ def getTimeSeriesForPoint(point, dateFrom=None, dateTo=datetime.datetime.now()):
         .reduceColumns(ee.Reducer.toList(len(properties)), properties) \
         .get('list') \
         .getInfo()
-    collectionBands = map(listToObject, collectionBands)
+    if columnar:
+        return gee.series.rowsToColumns(properties, collectionBands)
+    collectionBands = list(map(listToObject, collectionBands))
 
     return collectionBands
 
-def getTimeSeriesAssetForPoint(point, dateFrom=None, dateTo=datetime.datetime.now()):
+# name -> yearly ImageCollection sampled by getTimeSeriesAssetForPoint
+TIME_SERIES_ASSETS = {
+    'tcc': 'projects/servir-mekong/UMD/tree_canopy',
+    'loss': 'projects/servir-mekong/UMD/loss',
+    'croplands': 'projects/servir-mekong/yearly_primitives_smoothed/cropland'
+}
+
+@cached
+def getTimeSeriesAssetForPoint(point, dateFrom=None, dateTo=datetime.datetime.now(), assets=None):
+    """ [timestamp, {name: value}] of the assets (TIME_SERIES_ASSETS by default)
+    at point. All of them are sampled in one getInfo. """
     def sampleUsingPoint(image):
         image = ee.Image(image)
         timestamp = image.get("system:time_start")
         sampledValue = image.sample(ee.Geometry.Point(point),30).first().get(image.bandNames().get(0));
         return [timestamp, sampledValue]
 
-    def toDict(array):
-        d = {}
-        for pair in array:
-            d[pair[0]] = pair[1]
-        return d
+    assets = assets or TIME_SERIES_ASSETS
     try:
-        tcc = ee.ImageCollection("projects/servir-mekong/UMD/tree_canopy")
-        tcc = toDict(tcc.toList(tcc.size()).map(sampleUsingPoint).getInfo())
-        loss = ee.ImageCollection("projects/servir-mekong/UMD/loss")
-        loss = toDict(loss.toList(loss.size()).map(sampleUsingPoint).getInfo())
-        croplands = ee.ImageCollection("projects/servir-mekong/yearly_primitives_smoothed/cropland")
-        croplands = toDict(croplands.toList(croplands.size()).map(sampleUsingPoint).getInfo())
-        # alltimestamps = reduce(lambda x, y: x.union(y.keys()), [tcc,loss,croplands], set())
-        alltimestamps = list(set().union(tcc.keys(),loss.keys(),croplands.keys()))
-        alltimestamps.sort()
-        timeseries = []
-        for timestamp in alltimestamps:
-            tempdict = {}
-            if (timestamp in tcc):
-                tempdict["tcc"] = tcc[timestamp]
-            else:
-                tempdict["tcc"] = None
-            if (timestamp in loss):
-                tempdict["loss"] = loss[timestamp]
-            else:
-                tempdict["loss"] = None
-            if (timestamp in croplands):
-                tempdict["croplands"] = croplands[timestamp]
-            else:
-                tempdict["croplands"] = None
-            timeseries.append([timestamp, tempdict])
+        sampled = {}
+        for name, assetId in assets.items():
+            collection = ee.ImageCollection(assetId)
+            sampled[name] = collection.toList(collection.size()).map(sampleUsingPoint)
+        sampled = ee.Dictionary(sampled).getInfo()
     except EEException as e:
         raise GEEException(sys.exc_info()[0])
-    return timeseries
-
-def getStatistics(paramType, aOIPoly):
-    values = {}
-    if (paramType == 'basin'):
-        basinFC = ee.FeatureCollection('ft:1aIbTi69cXMMIm5ZvHNC67hVmhefPDLfEat15iike')
-        basin = basinFC.filter(ee.Filter.eq('SubBasin', aOIPoly)).first();
-        poly = basin.geometry()
-    elif (paramType == 'landscape'):
-        lscapeFC = ee.FeatureCollection('ft:1XuZH2r-oai_knDgWiOUxyDjlHZQKsEZChOjGsTjr')
-        landscape = lscapeFC.filter(ee.Filter.eq('NAME', aOIPoly)).first();
-        poly = landscape.geometry()
-    else:
-        poly = ee.Geometry.Polygon(aOIPoly)
+    return mergeAssetSeries(sampled, list(assets))
+
+def mergeAssetSeries(sampled, names):
+    """ [timestamp, {name: value}] for every timestamp of any of the sampled
+    [[timestamp, value], ...] series, None where a series has no value """
+    timestamps = np.unique(np.concatenate(
+        [np.array([pair[0] for pair in sampled[name]], np.int64) for name in names] + [np.empty(0, np.int64)]))
+    columns = []
+    for name in names:
+        times = np.array([pair[0] for pair in sampled[name]], np.int64)
+        values = np.array([pair[1] for pair in sampled[name]] + [None], object)[:-1]
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        values = values[order]
+        # the last value of a timestamp wins, like the dict the series used to be merged through
+        positions = np.searchsorted(times, timestamps, side='right') - 1
+        found = (positions >= 0) & (times[np.maximum(positions, 0)] == timestamps) if len(times) else \
+            np.zeros(len(timestamps), bool)
+        column = np.full(len(timestamps), None, object)
+        column[found] = values[positions[found]]
+        columns.append(column.tolist())
+    return [[timestamp, dict(zip(names, row))] for timestamp, row in zip(timestamps.tolist(), zip(*columns))]
+
+# paramType -> (FeatureCollection, name property) of the named regions of getStatistics
+NAMED_REGIONS = {
+    'basin': ('ft:1aIbTi69cXMMIm5ZvHNC67hVmhefPDLfEat15iike', 'SubBasin'),
+    'landscape': ('ft:1XuZH2r-oai_knDgWiOUxyDjlHZQKsEZChOjGsTjr', 'NAME')
+}
+
+def getStatisticsDictionary(poly):
+    """ ee.Dictionary of the elevation range and population of poly """
     elev = ee.Image('USGS/GTOPO30')
     minmaxElev = elev.reduceRegion(ee.Reducer.minMax(), poly, 1000, maxPixels=500000000)
-    minElev = minmaxElev.get('elevation_min').getInfo()
-    maxElev = minmaxElev.get('elevation_max').getInfo()
     ciesinPopGrid = ee.Image('CIESIN/GPWv4/population-count/2015')
     popDict = ciesinPopGrid.reduceRegion(ee.Reducer.sum(), poly, maxPixels=500000000)
-    pop = popDict.get('population-count').getInfo()
-    pop = int(pop)
-    values = {
+    return ee.Dictionary({
+        'minElev': minmaxElev.get('elevation_min'),
+        'maxElev': minmaxElev.get('elevation_max'),
+        'pop': popDict.get('population-count')
+    })
+
+def toStatistics(minElev, maxElev, pop):
+    return {
         'minElev': minElev,
         'maxElev': maxElev,
-        'pop': pop
+        'pop': int(pop) if pop is not None else None
     }
-    return values
+
+def computeNamedStatistics(paramType):
+    """ {name: statistics} of every named region of paramType, in one getInfo """
+    collectionId, nameProperty = NAMED_REGIONS[paramType]
+    def regionStatistics(region):
+        return ee.Feature(None, getStatisticsDictionary(region.geometry())).set('name', region.get(nameProperty))
+    rows = ee.FeatureCollection(collectionId).map(regionStatistics) \
+        .reduceColumns(ee.Reducer.toList(4), ['name', 'minElev', 'maxElev', 'pop']) \
+        .get('list') \
+        .getInfo()
+    return dict((name, toStatistics(minElev, maxElev, pop)) for name, minElev, maxElev, pop in rows)
+
+@cached
+def getStatistics(paramType, aOIPoly):
+    """ Elevation range and population of a polygon or of a named basin or
+    landscape, those from the precomputed region statistics when available.
+    One getInfo either way. """
+    if (paramType in NAMED_REGIONS):
+        values = gee.regionstats.lookup(paramType, aOIPoly, list(NAMED_REGIONS), computeNamedStatistics)
+        if values is not None:
+            return values
+        collectionId, nameProperty = NAMED_REGIONS[paramType]
+        region = ee.FeatureCollection(collectionId).filter(ee.Filter.eq(nameProperty, aOIPoly)).first();
+        poly = region.geometry()
+    else:
+        poly = ee.Geometry.Polygon(aOIPoly)
+    values = getStatisticsDictionary(poly).getInfo()
+    return toStatistics(values.get('minElev'), values.get('maxElev'), values.get('pop'))
 
 def getAsterMosaic(visParams={}, dateFrom=None, dateTo=None):
     """  """
@@ -1124,32 +1346,45 @@ def getImageCollection(point, year=None):
 
     return all
 
+@cached
 def getLandsatImages(point, year=None):
     all = getImageCollection(point, year)
     ids = all.toList(all.size()).map(lambda image: ee.Image(image).get('system:id'))
     return ids.getInfo()
 
+def chipBox(image, point, size):
+    """ Square of size pixels of image centered on point """
+    pixelSize = image.projection().nominalScale()
+    return ee.Geometry.Point(point).buffer(pixelSize.multiply(size / 2.0), 5).bounds(5)
+
+def getChipMetadata(image, box):
+    """ id, day of year, satellite and chip region of image in one round trip """
+    return ee.Dictionary({
+        'iid': image.get('system:id'),
+        'doy': ee.Date(image.get('system:time_start')).getRelative('day', 'year'),
+        'sensor': image.get('SATELLITE'),
+        'region': box
+    }).getInfo()
+
 def createChip(image, point, vis, size=255):
     '''
     generate a chip for an image
     '''
     this_image = ee.Image(image)
-    iid = this_image.get('system:id').getInfo()
-    doy = ee.Date(this_image.get('system:time_start')).getRelative('day', 'year').getInfo()
-    sensor = this_image.get('SATELLITE').getInfo()
+    box = chipBox(this_image, point, size)
+    metadata = getChipMetadata(this_image, box)
+    iid = metadata['iid']
+    doy = metadata['doy']
     src_bands = BAND_SET['LT05']
-    if sensor == 'LANDSAT_8':
+    if metadata.get('sensor') == 'LANDSAT_8':
         src_bands = BAND_SET['LC08']
 
-    pixelSize = ee.Image(image).projection().nominalScale()
-    box = ee.Geometry.Point(point).buffer(pixelSize.multiply(size / 2.0), 5).bounds(5)
-
     image = this_image.select(src_bands, BAND_NAMES)
     if vis == 'tc':
         image = tcTransform(image)
 
     params = {'dimensions': '%dx%d' % (size, size),
-              'region': box.getInfo()['coordinates'],
+              'region': metadata['region']['coordinates'],
               'format': 'png'}
 
     chip_url = ee.Image(image).visualize(**VIS_SET[vis]).unmask().getThumbURL(params)
@@ -1161,16 +1396,14 @@ def createChipXYZ(image, point, vis, size=255):
     generate a chip for an image
     '''
     this_image = ee.Image(image)
-    iid = this_image.get('system:id').getInfo()
-    doy = ee.Date(this_image.get('system:time_start')).getRelative('day', 'year').getInfo()
-    sensor = this_image.get('SATELLITE').getInfo()
+    box = chipBox(this_image, point, size)
+    metadata = getChipMetadata(this_image, box)
+    iid = metadata['iid']
+    doy = metadata['doy']
     src_bands = BAND_SET['LT05']
-    if sensor == 'LANDSAT_8':
+    if metadata.get('sensor') == 'LANDSAT_8':
         src_bands = BAND_SET['LC08']
 
-    pixelSize = ee.Image(image).projection().nominalScale()
-    box = ee.Geometry.Point(point).buffer(pixelSize.multiply(size / 2.0), 5).bounds(5)
-
     image = this_image.select(src_bands, BAND_NAMES)
     if vis == 'tc':
         image = tcTransform(image)
@@ -1211,8 +1444,9 @@ def getLandsatChipForYearByTargetDay(point, year, day, vis):
     return chip
 
 
-def getSpectralsForPoint(collection, point):
-    """ https://code.earthengine.google.com/49592558df4df130e9082f94a23a887f """
+def getSpectralsForPoint(collection, point, columnar=False):
+    """ https://code.earthengine.google.com/49592558df4df130e9082f94a23a887f
+    columnar returns {property: [values]} instead of one dict per image """
 
     # bandNames = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2', 'cfmask']
     bandNames = ["B1", "B2", "B3", "B4", "B5", "B7", 'cfmask']
@@ -1249,25 +1483,85 @@ def getSpectralsForPoint(collection, point):
         .get('list') \
         .getInfo()
 
+    if columnar:
+        return gee.series.rowsToColumns(properties, collectionBands)
     collectionBands = list(map(listToObject, collectionBands))
 
     return collectionBands
 
 
-def getTsTimeSeriesForPoint(point):
+SPECTRAL_COLLECTIONS = [('LT04', 'LANDSAT/LT04/C01/T1_SR'), ('LT05', 'LANDSAT/LT05/C01/T1_SR'),
+                        ('LE07', 'LANDSAT/LE07/C01/T1_SR'), ('LC08', 'LANDSAT/LC08/C01/T1_SR')]
+
+@cached
+def getSpectralsForPointByRegion(point, dateFrom=None, dateTo=None, columnar=False):
+    """ getSpectralsForPoint of the getImageCollection images, from a single
+    getRegion call on the raw SR bands. Unit scaling, cfmask decoding, dates
+    and the one image per day selection are done locally. """
+    aoi = ee.Geometry.Point(point)
+    collection = ee.ImageCollection([])
+    for sensor, name in SPECTRAL_COLLECTIONS:
+        sensorCollection = ee.ImageCollection(name).filterBounds(aoi)
+        if dateFrom and dateTo:
+            sensorCollection = sensorCollection.filterDate(dateFrom, dateTo)
+        collection = collection.merge(sensorCollection.select(BAND_SET[sensor], BAND_NAMES))
+    region = collection.getRegion(aoi, 30).getInfo()
+    return regionToSpectrals(region, columnar)
+
+def regionToSpectrals(region, columnar=False):
+    """ getSpectralsForPoint rows, or columns, of the getRegion result of
+    getSpectralsForPointByRegion """
+    properties = BAND_NAMES + ['image_year', 'image_julday', 'iid']
+    sensors = [sensor for sensor, name in SPECTRAL_COLLECTIONS]
+    timeColumn = region[0].index('time')
+    bandColumns = [region[0].index(band) for band in BAND_NAMES]
+    images = []
+    for row in region[1:]:
+        # merged image ids carry the indexes of the merges, e.g. 1_1_LC08_044034_20130411
+        index = re.sub(r'^(\d+_)+', '', row[0])
+        images.append((sensors.index(index[:4]), row[timeColumn], index, row))
+    # the first image of every day in sensor order, like distinct('YYYYDDD')
+    images.sort(key=lambda image: image[:2])
+    byDay = {}
+    for image in images:
+        byDay.setdefault(image[1] // gee.series.DAY_MS, image)
+    images = sorted(byDay.values(), key=lambda image: image[1])
+
+    bands = np.array([[image[3][column] for column in bandColumns] for image in images], np.float64) \
+        .reshape(len(images), len(BAND_NAMES))
+    columns = dict((band, gee.series.toList(bands[:, i] / 10000)) for i, band in enumerate(BAND_NAMES[:-1]))
+    columns['cfmask'] = [None if value != value else int(value)
+                         for value in gee.series.decodeFmask(bands[:, -1]).tolist()]
+    years, days = gee.series.yearAndDayOfYear([image[1] for image in images])
+    columns['image_year'] = years.tolist()
+    columns['image_julday'] = days.tolist()
+    columns['iid'] = [dict(SPECTRAL_COLLECTIONS)[image[2][:4]] + '/' + image[2] for image in images]
+    if columnar:
+        return dict((name, columns[name]) for name in properties)
+    return [dict(zip(properties, values)) for values in zip(*[columns[name] for name in properties])]
+
+@cached
+def getTsTimeSeriesForPoint(point, columnar=False):
     collection = ee.ImageCollection(getImageCollection(point))#.map(parseQA2FMask)
-    return getSpectralsForPoint(collection, ee.Geometry.Point(point))
+    return getSpectralsForPoint(collection, ee.Geometry.Point(point), columnar)
     # return getTimeSeriesForPoint(ee.Geometry.Point(point))
 
-def getTsTimeSeriesForPointByYear(point, year):
+@cached
+def getTsTimeSeriesForPointInRange(point, dateFrom, dateTo, columnar=False):
+    collection = ee.ImageCollection(getImageCollection(point)).filterDate(dateFrom, dateTo)
+    return getSpectralsForPoint(collection, ee.Geometry.Point(point), columnar)
+
+@cached
+def getTsTimeSeriesForPointByYear(point, year, columnar=False):
     collection = ee.ImageCollection(getImageCollection(point)) \
         .filterDate(ee.Date.fromYMD(year, 1, 1), ee.Date.fromYMD(year, 12, 31)) \
         .map(parseQA2FMask)
 
-    return getSpectralsForPoint(collection, ee.Geometry.Point(point))
+    return getSpectralsForPoint(collection, ee.Geometry.Point(point), columnar)
     # return getTimeSeriesForPoint(ee.Geometry.Point(point))
 
-def getTsTimeSeriesForPointByTargetDay(point, day, startYear=1985, endYear=None):
+@cached
+def getTsTimeSeriesForPointByTargetDay(point, day, startYear=1985, endYear=None, columnar=False):
     '''
         retrieve time series for specified year range using target day.
     '''
@@ -1290,5 +1584,5 @@ def getTsTimeSeriesForPointByTargetDay(point, day, startYear=1985, endYear=None)
         lambda y: collection.filterDate(ee.Date.fromYMD(y, 1, 1), ee.Date.fromYMD(y, 12, 31)).sort('offset').first()
     )
 
-    return getSpectralsForPoint(ee.ImageCollection(images), ee.Geometry.Point(point))
+    return getSpectralsForPoint(ee.ImageCollection(images), ee.Geometry.Point(point), columnar)
     # return getTimeSeriesForPoint(ee.Geometry.Point
\ No newline at end of file
@@ -1,8 +1,22 @@
+from warmup import importModules, warmup, getStartupTimings
+importModules()
 from flask_cors import CORS
 from gee.utils import *
 from gee.inputs import *
+from gee.session import getSessionStats, unbindSession, configure as configureSessions
+from gee.cache import getCacheStats, configure as configureCaches
+from gee.singleflight import getSingleFlightStats, configure as configureSingleFlight
+from gee.tsstore import getStoreStats, configure as configureTimeSeriesStore
+from gee.fanout import byWindow, tomorrow, configure as configureFanOut
+from gee.scale import configure as configureScale
+from gee.series import FORMATS, downsample, formatTimeSeries, toMsgpack
+from gee.pixel import snapPoint
+from gee.regionstats import getRegionStatisticsStats, configure as configureRegionStatistics
+from gee.dateindex import getDateIndexStats, configure as configureDateIndex
+from gee.chipcache import getChip, getChipCacheStats, configure as configureChipCache
 from planet.utils import *
-from flask import Flask, request, jsonify, render_template, json, current_app, send_file, make_response
+from flask import Flask, request, jsonify, render_template, json, current_app, send_file, make_response, \
+    Response, stream_with_context
 import logging
 from logging.handlers import RotatingFileHandler
 import urllib
@@ -10,6 +24,7 @@ import urllib.parse
 import distutils
 from distutils import util
 import ast
+import io
 from datetime import datetime
 
 # test
@@ -22,6 +37,30 @@ gee_gateway = Flask(__name__, instance_relative_config=True,
                     static_url_path="/static", static_folder="./static")
 gee_gateway.config.from_object('config')
 gee_gateway.config.from_pyfile('config.py', silent=True)
+configureSessions(gee_gateway.config.get('EE_USER_SESSION_POOL_SIZE'),
+                  gee_gateway.config.get('EE_USER_SESSION_TTL'))
+configureCaches(gee_gateway.config.get('MAP_ID_CACHE_SIZE'),
+                gee_gateway.config.get('MAP_ID_CACHE_TTL'),
+                gee_gateway.config.get('RESULT_CACHE_BACKEND'),
+                gee_gateway.config.get('RESULT_CACHE_LOCATION'),
+                gee_gateway.config.get('RESULT_CACHE_SIZE'),
+                gee_gateway.config.get('RESULT_CACHE_TTL'))
+configureSingleFlight(gee_gateway.config.get('SINGLE_FLIGHT_LOCK_DIR'),
+                      gee_gateway.config.get('SINGLE_FLIGHT_RESULT_TTL'))
+configureTimeSeriesStore(gee_gateway.config.get('TIME_SERIES_STORE_PATH'),
+                         gee_gateway.config.get('TIME_SERIES_STORE_LOOKBACK_DAYS'))
+configureFanOut(gee_gateway.config.get('FAN_OUT_WORKERS'),
+                gee_gateway.config.get('FAN_OUT_YEARS'))
+configureScale(gee_gateway.config.get('ADAPTIVE_SCALE_MAX_PIXELS'),
+               gee_gateway.config.get('ADAPTIVE_SCALE_RETRIES'))
+configureRegionStatistics(gee_gateway.config.get('REGION_STATISTICS_PATH'),
+                          gee_gateway.config.get('REGION_STATISTICS_REFRESH'))
+configureDateIndex(gee_gateway.config.get('COLLECTION_DATE_INDEX_PATH'),
+                   gee_gateway.config.get('COLLECTION_DATE_INDEX_LOOKBACK_DAYS'))
+configureChipCache(gee_gateway.config.get('CHIP_CACHE_PATH'),
+                   gee_gateway.config.get('CHIP_CACHE_MAX_BYTES'))
+if gee_gateway.config.get('WARMUP', False):
+    warmup(gee_gateway.config)
 # CORS(gee_gateway)
 
 
@@ -35,7 +74,10 @@ def before():
             google_tokens = user.get('googleTokens', None)
             if google_tokens:
                 ee_user_token = google_tokens['accessToken']
-                initialize(ee_user_token=ee_user_token,
+                ee_token_expiry = google_tokens.get('accessTokenExpiryDate', None)
+                if ee_token_expiry:
+                    ee_token_expiry = ee_token_expiry / 1000.0
+                initialize(ee_user_token=ee_user_token, ee_token_expiry=ee_token_expiry,
                            ee_account=ee_account, ee_key_path=ee_key_path)
         else:
             initialize(ee_account=ee_account, ee_key_path=ee_key_path)
@@ -45,11 +87,154 @@ def before():
         CORS(gee_gateway)
 
 
+@gee_gateway.teardown_request
+def teardown(exception=None):
+    unbindSession()
+
+
+def wants_stream(request_json=None):
+    """ Streaming is opt-in: ?stream=true, "stream": true in the json body
+    or an Accept: application/x-ndjson header. """
+    stream = request.args.get('stream', (request_json or {}).get('stream', False))
+    if isinstance(stream, str):
+        stream = stream.lower() in ('1', 'true', 'yes')
+    return bool(stream) or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def response_format(request_json=None):
+    """ rows (default), columnar, packed or msgpack, see gee.series.formatTimeSeries """
+    response_format = request.args.get('format', (request_json or {}).get('format', 'rows'))
+    if response_format not in FORMATS:
+        raise GEEException("unknown format " + str(response_format))
+    return response_format
+
+
+def snap_point(point):
+    """ point moved to the center of its Landsat pixel, unless SNAP_POINTS is
+    off, so that every click inside a pixel shares the cached results. """
+    if current_app.config.get('SNAP_POINTS', True):
+        return snapPoint(point)[1]
+    return point
+
+
+def chip_response(chip):
+    """ png attachment of a getChip result with its doy and iid headers, the
+    chip_url one when it was just downloaded, and its ETag, 304 when the
+    client already has it. """
+    fname = '%s_%s.png' % (chip.get('iid'), chip.get('doy'))
+    response = make_response(send_file(
+        io.BytesIO(chip['data']), mimetype='image/png', as_attachment=True, attachment_filename=fname))
+    response.headers['doy'] = chip.get('doy')
+    response.headers['iid'] = chip.get('iid')
+    if chip.get('chip_url'):
+        response.headers['chip_url'] = chip['chip_url']
+    response.set_etag(chip['etag'])
+    return response.make_conditional(request)
+
+
+def spectrals_engine():
+    """ How /ts/spectrals extracts the point values: reduceRegion (one reduction
+    per image) or getRegion (one call, decoded locally). ?engine= overrides
+    the SPECTRALS_ENGINE setting. """
+    return request.args.get('engine', current_app.config.get('SPECTRALS_ENGINE', 'reduceRegion'))
+
+
+def max_points(request_json=None):
+    """ Optional maxPoints of the request, the size charts downsample series to. """
+    value = request.args.get('maxPoints', (request_json or {}).get('maxPoints', None))
+    if not value:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise GEEException("maxPoints must be an integer, got " + str(value))
+    if value < 3:
+        raise GEEException("maxPoints must be at least 3, got " + str(value))
+    return value
+
+
+def format_time_series(timeseries, response_format='rows', max_points=None, by_index=False):
+    """ timeseries in response_format, [time, value] series downsampled to
+    max_points first. by_index formats each series of an {index: series} dict. """
+    if by_index:
+        return dict((name, format_time_series(series, response_format, max_points))
+                    for name, series in timeseries.items())
+    return formatTimeSeries(downsample(timeseries, max_points), response_format)
+
+
+def time_series_response(timeseries, response_format='rows', max_points=None, by_index=False):
+    """ {timeseries} in response_format, as json or as msgpack. """
+    values = {
+        'timeseries': format_time_series(timeseries, response_format, max_points, by_index)
+    }
+    if response_format == 'msgpack':
+        return Response(toMsgpack(values), mimetype='application/x-msgpack'), 200
+    return jsonify(values), 200
+
+
+def stream_windows(windows, response_format='rows', by_index=False):
+    """ NDJSON response with one {dateFrom, dateTo, timeseries} line per
+    (dateFrom, dateTo, timeseries) of windows, written as soon as it is
+    computed. A failure ends the stream with an {errMsg} line. """
+    if response_format == 'msgpack':
+        response_format = 'packed'
+    def generate():
+        try:
+            for date_from, date_to, timeseries in windows:
+                timeseries = format_time_series(timeseries, response_format, by_index=by_index)
+                yield json.dumps({'dateFrom': date_from, 'dateTo': date_to, 'timeseries': timeseries}) + '\n'
+        except (GEEException, EEException) as e:
+            logger.error(str(e))
+            yield json.dumps({'errMsg': str(e)}) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @gee_gateway.route('/', methods=['GET'])
 def index():
     return render_template('index.html')
 
 
+@gee_gateway.route('/gatewayStats', methods=['GET'])
+def gateway_stats():
+    """
+    .. :quickref: gatewayStats; Get the per-worker cache and session counters.
+
+    **Example response**:
+
+    .. code-block:: javascript
+
+        {
+            session: {
+                serviceAccount: {initialized: 1, refreshed: 0, reused: 42, errors: 0},
+                users: {created: 3, reused: 40, expired: 1, evicted: 0, size: 2}
+            },
+            cache: {
+                mapId: {hits: 120, misses: 14, errors: 0, backend: {...}},
+                result: {hits: 37, misses: 52, errors: 0, backend: {backend: "sqlite", size: 89}}
+            },
+            singleFlight: {computed: 30, coalesced: 11, shared: 4},
+            timeSeriesStore: {hits: 8, partial: 21, misses: 5},
+            regionStatistics: {hits: 12, misses: 1, refreshed: 2, errors: 0, size: 58},
+            collectionDates: {hits: 30, partial: 6, misses: 2},
+            chips: {hits: 410, misses: 96, evicted: 0, size: 120, bytes: 9830400},
+            startup: {imports: 2.104, initialize: 0.913, collections: 0.412}
+        }
+
+    :resheader Content-Type: application/json
+    """
+    values = {
+        'session': getSessionStats(),
+        'cache': getCacheStats(),
+        'singleFlight': getSingleFlightStats(),
+        'timeSeriesStore': getStoreStats(),
+        'regionStatistics': getRegionStatisticsStats(),
+        'collectionDates': getDateIndexStats(),
+        'chips': getChipCacheStats(),
+        'startup': getStartupTimings()
+    }
+    return jsonify(values), 200
+
+
 ############################### CEO GeoDash ##############################
 
 ### Helper Routes
@@ -774,6 +959,9 @@ def time_series_index():
     :<json Array polygon: the region over which to reduce data
     :<json String dateFrom: start date
     :<json String dateTo: end date
+    :<json Boolean stream: optional, stream one NDJSON {dateFrom, dateTo, timeseries} line per date window
+    :<json String format: optional, rows (default), columnar, packed (base64 float32/int columns) or msgpack
+    :<json Integer maxPoints: optional, downsample the series to about maxPoints points, keeping its extrema
     :resheader Content-Type: application/json
     """
     try:
@@ -782,6 +970,17 @@ def time_series_index():
             geometry = request_json.get('polygon', None)  # deprecated
             if not geometry:
                 geometry = request_json.get('geometry', None)
+            if geometry and wants_stream(request_json):
+                collection_name = request_json.get('collectionNameTimeSeries', None)
+                index_name = request_json.get('indexName', None)
+                scale = float(request_json.get('scale', 30))
+                reducer = request_json.get('reducer', None)
+                return stream_windows(byWindow(
+                    lambda date_from, date_to: getTimeSeriesByCollectionAndIndex(
+                        collection_name, index_name, scale, geometry, date_from, date_to, reducer),
+                    request_json.get('dateFromTimeSeries', None),
+                    request_json.get('dateToTimeSeries', None)),
+                    response_format(request_json))
             if geometry:
                 # "MODIS/006/MOD13A2",
                 timeseries = getTimeSeriesByCollectionAndIndex(request_json.get('collectionNameTimeSeries', None),
@@ -792,9 +991,7 @@ def time_series_index():
                                                                request_json.get('dateToTimeSeries', None),
                                                                request_json.get('reducer', None)
                                                                )
-                values = {
-                    'timeseries': timeseries
-                }
+                return time_series_response(timeseries, response_format(request_json), max_points(request_json))
             else:
                 raise Exception
         else:
@@ -841,11 +1038,14 @@ def time_series_index2():
         }
 
     :reqheader Accept: application/json
-    :<json String index: name of the index:  (e.g. NDVI, NDWI, NVI)
+    :<json String index: name of the index:  (e.g. NDVI, NDWI, NVI), or a list of them to get {index: timeseries}
     :<json Float scale: scale in meters of the projection
     :<json Array polygon: the region over which to reduce data
     :<json String dateFrom: start date
     :<json String dateTo: end date
+    :<json Boolean stream: optional, stream one NDJSON {dateFrom, dateTo, timeseries} line per date window
+    :<json String format: optional, rows (default), columnar, packed (base64 float32/int columns) or msgpack
+    :<json Integer maxPoints: optional, downsample the series to about maxPoints points, keeping its extrema
     :resheader Content-Type: application/json
     """
     values = {}
@@ -861,10 +1061,91 @@ def time_series_index2():
                 reducer = request_json.get('reducer', 'median')
                 date_from = request_json.get('dateFromTimeSeries', None)
                 date_to = request_json.get('dateToTimeSeries', None)
+                if wants_stream(request_json):
+                    return stream_windows(byWindow(
+                        lambda window_from, window_to: splitIndexSeries(index_name, computeTimeSeriesByIndex2(
+                            index_name, scale, geometry, window_from, window_to, reducer)),
+                        date_from, date_to),
+                        response_format(request_json), isinstance(index_name, list))
                 timeseries = getTimeSeriesByIndex2(index_name, scale, geometry, date_from, date_to, reducer)
+                return time_series_response(timeseries, response_format(request_json), max_points(request_json),
+                                            isinstance(index_name, list))
+    except GEEException as e:
+        logger.error(str(e))
+        values = {
+            'errMsg': str(e)
+        }
+    return jsonify(values), 200
+
+
+@gee_gateway.route('/timeSeriesIndexBatch', methods=['POST'])
+def time_series_index_batch():
+    """
+    .. :quickref: TimeSeriesBatch;
+    .. Get the timeseries for a specific index and date range for every plot of a FeatureCollection
+
+    **Example request**:
+
+    .. code-block:: javascript
+
+        {
+            indexName: "XX",
+            scale: 0.0,
+            featureCollection: {
+                type: "FeatureCollection",
+                features: [
+                    {type: "Feature", geometry: {...}, properties: {PLOTID: 1}},
+                    ...
+                ]
+            },
+            idField: "PLOTID",
+            dateFromTimeSeries: "YYYY-MM-DD",
+            dateToTimeSeries: "YYYY-MM-DD"
+        }
+
+    **Example response**:
+
+    .. code-block:: javascript
+
+        {
+            timeseries: {
+                "1": [
+                    [0, 0.0],
+                    ...
+                ],
+                ...
+            }
+        }
+
+    :reqheader Accept: application/json
+    :<json String indexName: name of the index:  (e.g. NDVI, NDWI, NVI)
+    :<json Float scale: scale in meters of the projection
+    :<json Object featureCollection: GeoJSON FeatureCollection of the plots
+    :<json String idField: plot property holding the plot id, defaults to PLOTID
+    :<json String dateFromTimeSeries: start date
+    :<json String dateToTimeSeries: end date
+    :resheader Content-Type: application/json
+    """
+    values = {}
+    try:
+        request_json = request.get_json()
+        if request_json:
+            feature_collection = request_json.get('featureCollection', None)
+            if feature_collection:
+                index_name = request_json.get('indexName', 'NDVI')
+                scale = float(request_json.get('scale', 30))
+                reducer = request_json.get('reducer', 'median')
+                date_from = request_json.get('dateFromTimeSeries', None)
+                date_to = request_json.get('dateToTimeSeries', None)
+                id_field = request_json.get('idField', 'PLOTID')
+                chunk_size = int(current_app.config.get('BATCH_CHUNK_SIZE', 100))
+                timeseries = getTimeSeriesByIndexBatch(index_name, scale, feature_collection, date_from, date_to,
+                                                       reducer, id_field, chunk_size)
                 values = {
                     'timeseries': timeseries
                 }
+            else:
+                raise GEEException("featureCollection is required")
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -912,7 +1193,8 @@ def time_series_asset_for_point():
             geometry = request_json.get('point', None)
             date_from = request_json.get('dateFromTimeSeries', None)
             date_to = request_json.get('dateToTimeSeries', None)
-            timeseries = getTimeSeriesAssetForPoint(geometry, date_from, date_to)
+            timeseries = getTimeSeriesAssetForPoint(geometry, date_from, date_to,
+                                                    current_app.config.get('TIME_SERIES_ASSETS', None))
             print("have vals")
             values = {
                 'timeseries': timeseries
@@ -1013,6 +1295,24 @@ def get_image_plot_degradition():
     return jsonify(values), 200
 
 
+def degradition_vis_params(request_json):
+    """ visParams of the request, else those of its stretch (321 by default). """
+    stretch = request_json.get('stretch', 321)
+    vis_params = {}
+    if stretch == 321:
+        vis_params = {'bands': 'RED,GREEN,BLUE', 'min': 0, 'max': 1400}
+    elif stretch == 543:
+        vis_params = {'bands': 'SWIR1,NIR,RED', 'min': 0, 'max': 7000}
+    elif stretch == 453:
+        vis_params = {'bands': 'NIR,SWIR1,RED', 'min': 0, 'max': 7000}
+    elif stretch == "SAR":
+        vis_params = {'bands': 'VV,VH,VV/VH', 'min': '-15,-25,.40', 'max': '0,-10,1', 'gamma': '1.6'}
+    tparams = request_json.get('visParams', "")
+    if tparams != "":
+        vis_params = tparams
+    return vis_params
+
+
 @gee_gateway.route('/getAvailableCollectionDates', methods=['POST'])
 def get_available_collection_dates():
     try:
@@ -1028,8 +1328,14 @@ def get_available_collection_dates():
             start = request_json.get('start')
             end = request_json.get('end', datetime.today().strftime('%Y-%m-%d'))
             #      # geometry = ee.Geometry.Polygon(geometry)
+            available_dates = get_collection_dates_in_range(geometry, start, end, collection)
+            prefetch_count = current_app.config.get('DEGRADATION_PREFETCH_DATES', 0)
+            if prefetch_count and request_json.get('dataType', 'landsat') == 'landsat':
+                prefetchDegraditionTileUrls(geometry, available_dates, degradition_vis_params(request_json),
+                                            request_json.get('nearDate'), prefetch_count,
+                                            current_app.config.get('DEGRADATION_PREFETCH_WORKERS', 2))
             values = {
-                'available_dates': get_collection_dates_in_range(geometry, start, end, collection)
+                'available_dates': available_dates
             }
         else:
             raise Exception(
@@ -1049,21 +1355,9 @@ def get_degradition_tile_url():
         if json:
             image_date = request_json.get('imageDate', None)
             geometry = request_json.get('geometry')
-            stretch = request_json.get('stretch', 321)
-            vis_params = {}
-            if stretch == 321:
-                vis_params = {'bands': 'RED,GREEN,BLUE', 'min': 0, 'max': 1400}
-            elif stretch == 543:
-                vis_params = {'bands': 'SWIR1,NIR,RED', 'min': 0, 'max': 7000}
-            elif stretch == 453:
-                vis_params = {'bands': 'NIR,SWIR1,RED', 'min': 0, 'max': 7000}
-            elif stretch == "SAR":
-                vis_params = {'bands': 'VV,VH,VV/VH', 'min': '-15,-25,.40', 'max': '0,-10,1', 'gamma': '1.6'}
-            tparams = request_json.get('visParams', "")
+            vis_params = degradition_vis_params(request_json)
 
             data_type = request_json.get('dataType', 'landsat')
-            if tparams != "":
-                vis_params = tparams
             if data_type == 'landsat':
                 values = {
                     "url": getDegraditionTileUrlByDate(geometry, image_date, vis_params)
@@ -1164,11 +1458,14 @@ def time_series_index3():
 
     :reqheader Accept: application/json
     :<json String collectionName: name of the image collection
-    :<json String index: name of the index:  (e.g. NDVI, NDWI, NVI)
+    :<json String index: name of the index:  (e.g. NDVI, NDWI, NVI), or a list of them to get {index: timeseries}
     :<json Float scale: scale in meters of the projection
     :<json Array polygon: the region over which to reduce data
     :<json String dateFrom: start date
     :<json String dateTo: end date
+    :<json Boolean stream: optional, stream one NDJSON {dateFrom, dateTo, timeseries} line per date window
+    :<json String format: optional, rows (default), columnar, packed (base64 float32/int columns) or msgpack
+    :<json Integer maxPoints: optional, downsample the series to about maxPoints points, keeping its extrema
     :resheader Content-Type: application/json
     """
     values = {}
@@ -1184,11 +1481,16 @@ def time_series_index3():
                 reducer = request_json.get('reducer', None)
                 date_from = request_json.get('dateFrom', None)
                 date_to = request_json.get('dateTo', None)
+                if wants_stream(request_json):
+                    return stream_windows(byWindow(
+                        lambda window_from, window_to: splitIndexSeries(index_name, computeTimeSeriesByIndex2(
+                            index_name, scale, geometry, window_from, window_to, reducer)),
+                        date_from, date_to),
+                        response_format(request_json), isinstance(index_name, list))
                 timeseries = getTimeSeriesByIndex2(
                     index_name, scale, geometry, date_from, date_to, reducer)
-                values = {
-                    'timeseries': timeseries
-                }
+                return time_series_response(timeseries, response_format(request_json), max_points(request_json),
+                                            isinstance(index_name, list))
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -1227,6 +1529,8 @@ def time_series_for_point():
     :<json Array point: the point which to reduce data
     :<json String dateFrom: start date
     :<json String dateTo: end date
+    :<json Boolean stream: optional, stream one NDJSON {dateFrom, dateTo, timeseries} line per date window
+    :<json String format: optional, rows (default), columnar, packed (base64 float32/int columns) or msgpack
     :resheader Content-Type: application/json
     """
     values = {}
@@ -1235,10 +1539,17 @@ def time_series_for_point():
         if request_json:
             geometry = request_json.get('point', None)
             if geometry:
-                timeseries = getTimeSeriesForPoint(geometry)
-                values = {
-                    'timeseries': timeseries
-                }
+                geometry = snap_point(geometry)
+            columnar = response_format(request_json) != 'rows'
+            if geometry and wants_stream(request_json):
+                return stream_windows(byWindow(
+                    lambda date_from, date_to: getTimeSeriesForPoint(geometry, date_from, date_to, columnar),
+                    request_json.get('dateFrom', '1982-01-01'),
+                    request_json.get('dateTo', tomorrow())),
+                    response_format(request_json))
+            if geometry:
+                timeseries = getTimeSeriesForPoint(geometry, columnar=columnar)
+                return time_series_response(timeseries, response_format(request_json))
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -1296,10 +1607,14 @@ def time_series_index_get():
         date_from = request.args.get('dateFromTimeSeries', None)
         date_to = request.args.get('dateToTimeSeries', None)
         reducer = request.args.get('reducer', None)
+        if wants_stream():
+            return stream_windows(byWindow(
+                lambda window_from, window_to: getTimeSeriesByIndex(
+                    index_name, scale, polygon, window_from, window_to, reducer),
+                date_from, date_to),
+                response_format())
         timeseries = getTimeSeriesByIndex(index_name, scale, polygon, date_from, date_to, reducer)
-        values = {
-            'timeseries': timeseries
-        }
+        return time_series_response(timeseries, response_format(), max_points())
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -1394,7 +1709,7 @@ def getAllLandsatImagesForPlot(lng, lat, year):
         if year <= 1980:
             year = None
 
-        values = getLandsatImages((float(lng), float(lat)), year)
+        values = getLandsatImages(snap_point((float(lng), float(lat))), year)
 
     except GEEException as e:
         logger.error(str(e))
@@ -1412,16 +1727,10 @@ def getChipForYearByTargetDay(lng, lat, year, day, vis):
 
     values = {}
     try:
-        values = getLandsatChipForYearByTargetDay(
-            (float(lng), float(lat)), year, day, vis)
-        fp = urllib.request.urlopen(values.get('chip_url'))
-        fname = '%s_%s.png' % (values.get('iid'), values.get('doy'))
-        response = make_response(send_file(
-            fp, mimetype='image/png', as_attachment=True, attachment_filename=fname))
-        response.headers['doy'] = values.get('doy')
-        response.headers['iid'] = values.get('iid')
-        response.headers['chip_url'] = values.get('chip_url')
-        return response, 200
+        point = snap_point((float(lng), float(lat)))
+        chip = getChip(lambda: getLandsatChipForYearByTargetDay(point, year, day, vis),
+                       point, vis, 255, year=year, day=day)
+        return chip_response(chip)
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -1447,15 +1756,9 @@ def getImageChip(lng, lat, iid, vis, size=255):
 
     values = {}
     try:
-        values = createChip(iid, (float(lng), float(lat)), vis, size)
-        fp = urllib.request.urlopen(values.get('chip_url'))
-        fname = '%s_%s.png' % (values.get('iid'), values.get('doy'))
-        response = make_response(send_file(
-            fp, mimetype='image/png', as_attachment=True, attachment_filename=fname))
-        response.headers['doy'] = values.get('doy')
-        response.headers['iid'] = values.get('iid')
-        response.headers['chip_url'] = values.get('chip_url')
-        return response, 200
+        point = snap_point((float(lng), float(lat)))
+        chip = getChip(lambda: createChip(iid, point, vis, size), point, vis, size, iid=iid)
+        return chip_response(chip)
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -1555,11 +1858,20 @@ def getPlotSpectrals(lng, lat):
     """
     values = {}
     try:
-        timeseries = getTsTimeSeriesForPoint((float(lng), float(lat)))
-        values = {
-            'timeseries': timeseries
-        }
-        return jsonify(values), 200
+        columnar = response_format() != 'rows'
+        point = snap_point((float(lng), float(lat)))
+        by_region = spectrals_engine() == 'getRegion'
+        if wants_stream():
+            spectrals = getSpectralsForPointByRegion if by_region else getTsTimeSeriesForPointInRange
+            return stream_windows(byWindow(
+                lambda date_from, date_to: spectrals(point, date_from, date_to, columnar),
+                '1982-01-01', tomorrow(), 1),
+                response_format())
+        if by_region:
+            timeseries = getSpectralsForPointByRegion(point, columnar=columnar)
+        else:
+            timeseries = getTsTimeSeriesForPoint(point, columnar)
+        return time_series_response(timeseries, response_format())
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -1582,13 +1894,21 @@ def getPlotSpectralsByYear(year, lng, lat):
     """
     values = {}
     try:
+        columnar = response_format() != 'rows'
+        point = snap_point((float(lng), float(lat)))
+        if spectrals_engine() == 'getRegion':
+            spectrals = lambda: getSpectralsForPointByRegion(
+                point, '%04d-01-01' % year, '%04d-12-31' % year, columnar)
+        else:
+            spectrals = lambda: getTsTimeSeriesForPointByYear(point, int(year), columnar)
+        if wants_stream():
+            return stream_windows(byWindow(
+                lambda date_from, date_to: spectrals(),
+                '%04d-01-01' % year, '%04d-01-01' % (year + 1)),
+                response_format())
         # timeseries = getTsTimeSeriesForPoint((float(lng), float(lat)))
-        timeseries = getTsTimeSeriesForPointByYear(
-            (float(lng), float(lat)), int(year))
-        values = {
-            'timeseries': timeseries
-        }
-        return jsonify(values), 200
+        timeseries = spectrals()
+        return time_series_response(timeseries, response_format())
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -1611,13 +1931,18 @@ def getPlotSpectralsByJulday(julday, lng, lat):
     """
     values = {}
     try:
+        columnar = response_format() != 'rows'
+        point = snap_point((float(lng), float(lat)))
+        if wants_stream():
+            end_year = datetime.today().year - 1
+            return stream_windows(byWindow(
+                lambda date_from, date_to: getTsTimeSeriesForPointByTargetDay(
+                    point, int(julday), int(date_from[:4]), int(date_from[:4]), columnar),
+                '1985-01-01', '%04d-01-01' % (end_year + 1), 1),
+                response_format())
         # timeseries = getTsTimeSeriesForPoint((float(lng), float(lat)))
-        timeseries = getTsTimeSeriesForPointByTargetDay(
-            (float(lng), float(lat)), int(julday))
-        values = {
-            'timeseries': timeseries
-        }
-        return jsonify(values), 200
+        timeseries = getTsTimeSeriesForPointByTargetDay(point, int(julday), columnar=columnar)
+        return time_series_response(timeseries, response_format())
     except GEEException as e:
         logger.error(str(e))
         values = {
@@ -0,0 +1,59 @@
+import pytest
+from gee.pixel import PIXEL_SIZE, FALSE_NORTHING_SOUTH, fromUtm, snapPoint, toUtm
+
+
+def northGrid(lon, lat):
+    """ easting and northing of lon/lat on the north grid of its zone, as
+    Landsat products use in both hemispheres """
+    zone, north, easting, northing = toUtm(lon, lat)
+    return easting, northing if north else northing - FALSE_NORTHING_SOUTH
+
+
+def test_central_meridian_on_the_equator():
+    zone, north, easting, northing = toUtm(3.0, 0.0)
+    assert (zone, north) == (31, True)
+    assert easting == pytest.approx(500000.0)
+    assert northing == pytest.approx(0.0, abs=1e-6)
+
+
+@pytest.mark.parametrize('lon, lat', [(-122.3, 37.8), (-47.9, -15.8), (151.2, -33.87), (10.0, 60.0)])
+def test_round_trip(lon, lat):
+    # 1e-8 degrees is about a millimeter
+    back = fromUtm(*toUtm(lon, lat))
+    assert back[0] == pytest.approx(lon, abs=1e-8)
+    assert back[1] == pytest.approx(lat, abs=1e-8)
+
+
+def test_north_point():
+    pixel, center = snapPoint((-122.3, 37.8))
+    assert pixel == '32610/18721/139462'
+    easting, northing = northGrid(*center)
+    assert easting == pytest.approx(18721 * PIXEL_SIZE, abs=1e-3)
+    assert northing == pytest.approx(139462 * PIXEL_SIZE, abs=1e-3)
+
+
+@pytest.mark.parametrize('point', [(-47.9, -15.8), (151.2, -33.87), (-70.6, -0.01)])
+def test_south_points_snap_on_the_north_grid(point):
+    pixel, center = snapPoint(point)
+    epsg, column, row = [int(part) for part in pixel.split('/')]
+    assert 32601 <= epsg <= 32660
+    assert row < 0
+    easting, northing = northGrid(*center)
+    assert easting == pytest.approx(column * PIXEL_SIZE, abs=1e-3)
+    assert northing == pytest.approx(row * PIXEL_SIZE, abs=1e-3)
+    # the center is within half a pixel of the point
+    pointEasting, pointNorthing = northGrid(*point)
+    assert abs(pointEasting - easting) <= PIXEL_SIZE / 2.0
+    assert abs(pointNorthing - northing) <= PIXEL_SIZE / 2.0
+
+
+@pytest.mark.parametrize('point', [(-122.3, 37.8), (-47.9, -15.8)])
+def test_points_of_a_pixel_share_it(point):
+    pixel, center = snapPoint(point)
+    assert snapPoint(center) == (pixel, center)
+    for dLon, dLat in [(0.0001, 0), (-0.0001, 0), (0, 0.0001), (0, -0.0001)]:
+        assert snapPoint((center[0] + dLon, center[1] + dLat))[0] == pixel
+
+
+def test_points_outside_utm_latitudes():
+    assert snapPoint((10.0, 85.0)) == ('10.000000/85.000000', (10.0, 85.0))
@@ -0,0 +1,60 @@
+import numpy as np
+from gee.series import downsample
+
+
+def series(size=1000, seed=0):
+    random = np.random.RandomState(seed)
+    values = random.uniform(-1, 1, size)
+    return [[1000 * i, float(value)] for i, value in enumerate(values)]
+
+
+def test_short_series_are_returned_as_they_are():
+    points = series(10)
+    assert downsample(points, 10) is points
+    assert downsample(points, None) is points
+
+
+def test_downsampled_size_and_order():
+    points = series()
+    sampled = downsample(points, 100)
+    # one more point when the minimum and maximum share a bucket
+    assert 100 <= len(sampled) <= 101
+    times = [p[0] for p in sampled]
+    assert times == sorted(times)
+    assert all(p in points for p in sampled)
+
+
+def test_first_last_and_extrema_are_kept():
+    points = series()
+    points[437][1] = 5.0
+    points[438][1] = -5.0
+    sampled = downsample(points, 50)
+    assert sampled[0] == points[0]
+    assert sampled[-1] == points[-1]
+    assert [437000, 5.0] in sampled
+    assert [438000, -5.0] in sampled
+    assert len(sampled) == 51
+
+
+def test_points_without_value_are_dropped():
+    points = series(200)
+    for i in range(0, 200, 3):
+        points[i][1] = None
+    sampled = downsample(points, 50)
+    assert all(p[1] is not None and p[1] == p[1] for p in sampled)
+    assert len(downsample(points, 150)) == 133
+
+
+def test_max_points_below_three_counts_as_three():
+    points = series()
+    for maxPoints in (1, 2, -5):
+        sampled = downsample(points, maxPoints)
+        assert 3 <= len(sampled) <= 5
+        assert sampled[0] == points[0] and sampled[-1] == points[-1]
+
+
+def test_other_series_are_returned_as_they_are():
+    rows = [{'time': i, 'value': i} for i in range(10)]
+    columns = {'time': list(range(10)), 'value': list(range(10))}
+    assert downsample(rows, 3) is rows
+    assert downsample(columns, 3) is columns
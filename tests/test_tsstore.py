@@ -0,0 +1,71 @@
+import time
+import gee.tsstore
+from gee.tsstore import TimeSeriesStore, toMillis
+
+
+def fakeCompute(calls):
+    """ compute returning one point on the first day of every month of the range """
+    def compute(dateFrom, dateTo):
+        calls.append((dateFrom, dateTo))
+        points = []
+        year, month = int(dateFrom[:4]), int(dateFrom[5:7])
+        while True:
+            date = '%04d-%02d-01' % (year, month)
+            if date >= dateTo:
+                return points
+            if date >= dateFrom:
+                points.append([toMillis(date), float(month)])
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return compute
+
+
+def test_miss_then_hit(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'ts.sqlite'))
+    calls = []
+    first = store.get('key', '2000-01-01', '2001-01-01', fakeCompute(calls))
+    second = store.get('key', '2000-01-01', '2001-01-01', fakeCompute(calls))
+    assert len(first) == 12
+    assert second == first
+    assert calls == [('2000-01-01', '2001-01-01')]
+    assert store.getStats() == {'hits': 1, 'partial': 0, 'misses': 1}
+
+
+def test_sub_range_is_served_from_the_store(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'ts.sqlite'))
+    calls = []
+    store.get('key', '2000-01-01', '2001-01-01', fakeCompute(calls))
+    points = store.get('key', '2000-03-01', '2000-06-01', fakeCompute(calls))
+    assert [p[0] for p in points] == [toMillis('2000-03-01'), toMillis('2000-04-01'), toMillis('2000-05-01')]
+    assert len(calls) == 1
+
+
+def test_only_missing_ranges_are_computed(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'ts.sqlite'))
+    calls = []
+    store.get('key', '2000-01-01', '2001-01-01', fakeCompute(calls))
+    points = store.get('key', '1999-01-01', '2002-01-01', fakeCompute(calls))
+    assert calls[1:] == [('1999-01-01', '2000-01-01'), ('2001-01-01', '2002-01-01')]
+    assert len(points) == 36
+    assert [p[0] for p in points] == sorted(p[0] for p in points)
+    assert store.getStats()['partial'] == 1
+
+
+def test_recent_dates_are_fetched_again(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'ts.sqlite'), lookbackDays=30)
+    calls = []
+    today = time.strftime('%Y-%m-%d', time.gmtime())
+    tomorrow = time.strftime('%Y-%m-%d', time.gmtime(time.time() + 86400))
+    store.get('key', '2000-01-01', tomorrow, fakeCompute(calls))
+    store.get('key', '2000-01-01', tomorrow, fakeCompute(calls))
+    assert len(calls) == 2
+    # the stored range is settled lookbackDays before it was fetched
+    assert calls[1][0] < today
+    assert calls[1][0] >= time.strftime('%Y-%m-%d', time.gmtime(time.time() - 31 * 86400))
+    assert calls[1][1] == tomorrow
+
+
+def test_incremental_without_store_computes(monkeypatch):
+    monkeypatch.setattr(gee.tsstore, 'timeSeriesStore', None)
+    calls = []
+    gee.tsstore.incremental('key', '2000-01-01', '2000-03-01', fakeCompute(calls))
+    assert calls == [('2000-01-01', '2000-03-01')]
@@ -0,0 +1,100 @@
+import collections
+import importlib
+import time
+import logging
+from logging.handlers import RotatingFileHandler
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+handler = RotatingFileHandler('gee-gateway-nginx.log', maxBytes=10485760, backupCount=10)
+logger.addHandler(handler)
+logger.setLevel(logging.DEBUG)
+
+WARM_MODULES = ['numpy', 'shapely.geometry', 'shapely_geojson', 'ee', 'flask',
+                'gee.inputs', 'gee.utils', 'planet.utils']
+
+# phase name -> seconds, in the order the phases ran
+timings = collections.OrderedDict()
+
+
+def _timed(phase, fn, *args):
+    began = time.time()
+    try:
+        return fn(*args)
+    finally:
+        timings[phase] = round(time.time() - began, 3)
+        logger.info("startup phase %s took %.3fs" % (phase, timings[phase]))
+
+
+def _importAll():
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+
+def importModules():
+    """ Import the heavy dependencies up front, in the uwsgi master when the
+    app is preloaded so every forked worker inherits them. """
+    _timed('imports', _importAll)
+
+
+def _initializeEE(config):
+    import gee.session
+    gee.session.initialize(config.get('EE_ACCOUNT'), config.get('EE_KEY_PATH'))
+
+
+def _prebuildCollections():
+    import ee
+    import gee.utils
+    # serializing walks the ee.ApiFunction signatures the first real request
+    # would otherwise have to resolve
+    gee.utils.getLandSatMergedCollection().serialize()
+    for name in ['LANDSAT/LC08/C01/T1_SR', 'LANDSAT/LE07/C01/T1_SR',
+                 'LANDSAT/LT05/C01/T1_SR', 'LANDSAT/LT04/C01/T1_SR']:
+        ee.ImageCollection(name).serialize()
+    # opens the HTTP connection to the EE api for this worker
+    ee.Number(0).getInfo()
+
+
+def _warmWorker(config):
+    try:
+        _timed('initialize', _initializeEE, config)
+        _timed('collections', _prebuildCollections)
+    except Exception as e:
+        logger.error("******warmup error************ " + str(e))
+    logger.info("worker warmup done: " + str(dict(timings)))
+
+
+def _isPreforkMaster():
+    """ True when uwsgi loads the app in the master and forks it afterwards. """
+    if uwsgi is None:
+        return False
+    lazy = uwsgi.opt.get('lazy-apps', uwsgi.opt.get('lazy', False))
+    if isinstance(lazy, bytes):
+        lazy = lazy.decode('utf-8')
+    return str(lazy).lower() not in ('1', 'true', 'yes', 'on')
+
+
+def warmup(config):
+    """ Initialize EE and pre-build the common collections for this worker.
+
+    With a preloaded app the EE session must not be created in the master
+    (its HTTP connections would be shared by every fork), so the EE phases
+    are deferred to a uwsgi postfork hook. In lazy-apps mode, or outside
+    uwsgi, they run right away.
+    """
+    if _isPreforkMaster():
+        from uwsgidecorators import postfork
+
+        @postfork
+        def warmForkedWorker():
+            _warmWorker(config)
+    else:
+        _warmWorker(config)
+
+
+def getStartupTimings():
+    return dict(timings)